@@ -0,0 +1,151 @@
+import json
+import threading
+
+import flask
+import numpy as np
+
+import geo
+
+# Batch "compare counties" endpoint for report generators.
+#
+#     POST /api/compare  {"fips": [1001, 6037, ...]}  or  {"state": "CA"}
+#     GET  /api/compare?fips=1001,6037  or  ?state=CA
+#
+# The response is NDJSON, one line per requested county in request order:
+#
+#     {"fips": 6037, "county_name": ..., "state_name": ..., "avg_aqi": ...,
+#      "recommendation": {"fips": ..., "county_name": ..., "avg_aqi": ...},
+#      "series": {"Ozone": {"year": [...], "avg_aqi": [...], "forecast": [...]}, ...}}
+#
+# Unknown counties get {"fips": ..., "error": "unknown county"}. Counties are
+# processed CHUNK at a time: each chunk's history rows are gathered and
+# grouped with one set of array operations, and its lines are streamed out
+# before the next chunk is read, so memory stays flat however many counties
+# are asked for.
+
+CHUNK = 256
+
+
+class CompareError(ValueError):
+    pass
+
+
+def _number(value):
+    # JSON has no NaN
+    return None if value != value else round(value, 2)
+
+
+class Comparer:
+
+    def __init__(self, county_index):
+        # Imported here so registering the endpoint does not pull in pandas;
+        # the history table has loaded it by now
+        import pandas as pd
+        from forecast import FORECAST
+
+        self.county_index = county_index
+        history = county_index.history
+        self.fips = history['fips_code'].to_numpy()
+        self.date = history['date'].to_numpy()
+        self.avg_aqi = history['avg_aqi'].to_numpy()
+        parameter = pd.Categorical(history['parameter_name'])
+        self.parameter, self.parameters = parameter.codes, [str(name) for name in parameter.categories]
+        forecast = pd.Categorical(history['forecast'])
+        # Missing labels have code -1, which picks the trailing False
+        self.is_forecast = np.append(np.asarray(forecast.categories == FORECAST), False)[forecast.codes]
+
+    def _series(self, codes):
+        # {fips: {pollutant: series}} for a chunk of known counties
+        rows = self.county_index.history_positions(codes)
+        if not len(rows):
+            return {}
+        fips, parameter, date = self.fips[rows], self.parameter[rows], self.date[rows]
+        order = np.lexsort((date, parameter, fips))
+        rows, fips, parameter = rows[order], fips[order], parameter[order]
+        starts = np.flatnonzero(np.r_[True, (fips[1:] != fips[:-1]) | (parameter[1:] != parameter[:-1])])
+        bounds = np.append(starts, len(rows))
+
+        out = {}
+        year = self.date[rows].tolist()
+        aqi = [None if v != v else v for v in np.round(self.avg_aqi[rows], 2).tolist()]
+        forecast = self.is_forecast[rows].tolist()
+        for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            series = out.setdefault(int(fips[start]), {})
+            series[self.parameters[parameter[start]]] = {'year': year[start:stop],
+                                                         'avg_aqi': aqi[start:stop],
+                                                         'forecast': forecast[start:stop]}
+        return out
+
+    def _record(self, code, series):
+        county = self.county_index.county(code)
+        if county is None:
+            return {'fips': code, 'error': 'unknown county'}
+        rec = self.county_index.recommendation(code)
+        return {'fips': code,
+                'county_name': county['county_name'],
+                'state_name': county['state_name'],
+                'avg_aqi': _number(county['avg_aqi']),
+                'recommendation': None if rec is None else {'fips': rec['rec_fips'],
+                                                            'county_name': rec['rec_county_name'],
+                                                            'avg_aqi': _number(rec['rec_avg_aqi'])},
+                'series': series.get(code, {})}
+
+    def lines(self, codes, chunk=CHUNK):
+        """NDJSON lines for `codes`, produced one chunk of counties at a time."""
+        for i in range(0, len(codes), chunk):
+            part = codes[i:i + chunk]
+            # Rows of repeated counties are gathered once; every line is still written
+            series = self._series(list(dict.fromkeys(part)))
+            yield ''.join(json.dumps(self._record(code, series), separators=(',', ':')) + '\n' for code in part)
+
+
+def select(county_index, fips=None, state=None):
+    """FIPS codes for a request: the given list, or every county of a state."""
+    if (fips is None) == (state is None):
+        raise CompareError("Give either 'fips' or 'state'")
+    if fips is not None:
+        if isinstance(fips, str):
+            fips = fips.split(',')
+        try:
+            return [int(code) for code in fips]
+        except (TypeError, ValueError):
+            raise CompareError("'fips' must be a list of FIPS codes")
+
+    state = str(state).strip()
+    for code, (name, usps) in geo.STATES.items():
+        if state.upper() == usps or state.lower() == name.lower() or state.lstrip('0') == str(code):
+            return [fips for fips in county_index.fips_codes() if fips // 1000 == code]
+    raise CompareError("Unknown state %r" % state)
+
+
+def serve_compare(server, get_county_index, prefix='/'):
+    """Register the batch endpoint at <prefix>api/compare.
+
+    `get_county_index` is only called, and the comparer built, on the first
+    request, so the app's data can be loaded lazily.
+    """
+    comparers = []
+    lock = threading.Lock()
+
+    def comparer():
+        with lock:
+            if not comparers:
+                comparers.append(Comparer(get_county_index()))
+        return comparers[0]
+
+    @server.route(prefix + 'api/compare', methods=['GET', 'POST'])
+    def compare():
+        if flask.request.method == 'POST':
+            body = flask.request.get_json(silent=True)
+            if not isinstance(body, dict):
+                return flask.jsonify(error="Expected a JSON object"), 400
+            fips, state = body.get('fips'), body.get('state')
+        else:
+            fips, state = flask.request.args.get('fips'), flask.request.args.get('state')
+        current = comparer()
+        try:
+            codes = select(current.county_index, fips, state)
+        except CompareError as e:
+            return flask.jsonify(error=str(e)), 400
+        return flask.Response(flask.stream_with_context(current.lines(codes)),
+                              mimetype='application/x-ndjson')
@@ -0,0 +1,174 @@
+import copy
+import hashlib
+import json
+import os
+import pickle
+import sys
+
+import dash
+import numpy as np
+import pandas as pd
+import plotly
+
+import choropleth
+import config
+import datastore
+import education
+import figures
+import forecast
+import geo
+import map_layers
+import recommend
+from county_index import CountyIndex
+from figure_cache import FigureCache
+from fileutil import atomic_write
+
+# The data behind the app and everything derived from it.
+#
+# app.py only builds this on first use (a request, or gunicorn's preload),
+# so importing the app stays cheap and pandas is not loaded until the data
+# is. The derived state is written to a snapshot in config.APP_SNAPSHOT_DIR
+# after a build, and restored instead of rebuilt on the next start with the
+# same data, geometry, settings, code (SOURCE_MODULES) and library versions.
+# The history table is not part of the snapshot: it is mapped from the
+# store again on restore. Bump SNAPSHOT_FORMAT when the pickled objects
+# change shape.
+#
+#     python app_state.py    # build and snapshot ahead of a deploy
+
+SNAPSHOT_FORMAT = 2
+
+# Modules whose code shapes the state: a change to any of them invalidates
+# the snapshots
+SOURCE_MODULES = [sys.modules[__name__], sys.modules[CountyIndex.__module__], choropleth, datastore, education,
+                  figures, forecast, geo, map_layers, recommend]
+
+
+class AppState:
+
+    def __init__(self, data_version, county_index, recommendation_year, recommendation_forecast, layers,
+                 dropdown_options, fig_choro, education_topics, education_content):
+        self.data_version = data_version
+        self.county_index = county_index
+        # Year the recommendations are for, and whether it is a forecast year
+        self.recommendation_year = recommendation_year
+        self.recommendation_forecast = recommendation_forecast
+        self.layers = layers
+        self.dropdown_options = dropdown_options
+        self.fig_choro = fig_choro
+        self.education_topics = education_topics
+        self.education_content = education_content
+        self.figure_cache = None
+
+    def __getstate__(self):
+        # Leave out the history (mapped from the store) and the figure cache
+        state = dict(self.__dict__, figure_cache=None)
+        state['county_index'] = copy.copy(self.county_index)
+        state['county_index'].history = None
+        return state
+
+
+def build(data_version=None, prefix='/'):
+    """Load the tables and derive everything the layout and callbacks need."""
+    # Tables are mapped from the columnar store (see datastore.py), FIPS codes are integers
+    df_choro = datastore.load_table('choropleth', data_version)
+    df_supp = datastore.load_table('supplementary_viz', data_version)
+
+    # Recommendations (optionally recomputed from the history, see recommend.py)
+    if config.RECOMMENDATION_YEAR is None:
+        df_rec2022 = datastore.load_table('recommendations_2022', data_version)
+    else:
+        df_rec2022 = recommend.history_recommendations(df_choro, df_supp, config.RECOMMENDATION_YEAR,
+                                                       config.RECOMMENDATION_WEIGHTS, config.RECOMMENDATION_K)
+
+    # The configured year, else the last year of the history (forecast
+    # included), which is the one ingest.py builds the recommendations from
+    date = df_supp['date'].to_numpy()
+    recommendation_year = config.RECOMMENDATION_YEAR or int(date.max())
+    historical = date[np.asarray(df_supp['forecast'].astype(str)) == forecast.HISTORICAL]
+    recommendation_forecast = recommendation_year > int(historical.max()) if len(historical) else True
+
+    # Dropdown options, one per county with history
+    df_fips_county = df_supp.groupby(['fips_code', 'county_name', 'state_name'], as_index=False, observed=True).count()
+    dropdown_options = [{'label': '%s, %s' % (county_name, state_name), 'value': fips}
+                        for fips, county_name, state_name in zip(df_fips_county['fips_code'].tolist(),
+                                                                 df_fips_county['county_name'].astype(str),
+                                                                 df_fips_county['state_name'].astype(str))]
+
+    # Educational content, compiled once from data/education.json (see education.py)
+    education_topics = education.load_topics()
+
+    return AppState(data_version,
+                    CountyIndex(df_choro, df_supp, df_rec2022),
+                    recommendation_year,
+                    recommendation_forecast,
+                    map_layers.MapLayers(df_choro, df_supp),
+                    dropdown_options,
+                    # Choropleth referencing the geometry by URL (see choropleth.py)
+                    choropleth.figure(df_choro, geo.counties_url(prefix=prefix)),
+                    education_topics,
+                    education.compile_topics(education_topics))
+
+
+##### Snapshots #####
+
+def snapshot_path(data_version, prefix='/'):
+    """Snapshot file for this data, geometry, settings and URL prefix (None if disabled)."""
+    if data_version is None or not config.APP_SNAPSHOT_DIR:
+        return None
+    sources = hashlib.sha256()
+    for path in [education.PATH] + [module.__file__ for module in SOURCE_MODULES]:
+        with open(path, 'rb') as f:
+            sources.update(f.read())
+    key = json.dumps([SNAPSHOT_FORMAT, data_version, geo.read_manifest()['version'], config.GEO_LEVEL, prefix,
+                      config.RECOMMENDATION_YEAR, config.RECOMMENDATION_K, config.RECOMMENDATION_WEIGHTS,
+                      config.TREND_POLLUTANTS, sources.hexdigest(),
+                      pd.__version__, np.__version__, plotly.__version__, dash.__version__], sort_keys=True)
+    return os.path.join(config.APP_SNAPSHOT_DIR, '%s.pickle' % hashlib.sha256(key.encode('utf-8')).hexdigest()[:16])
+
+
+def save(state, path):
+    try:
+        with atomic_write(path) as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        # Read-only file system: the state is simply rebuilt next time
+        pass
+
+
+def restore(path):
+    """The state saved at `path`, or None if there is no usable snapshot."""
+    try:
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+    except Exception:
+        # Missing, truncated or written by other code: rebuild it
+        return None
+    # The store keeps the history sorted by FIPS code, as the index expects
+    state.county_index.history = datastore.load_table('supplementary_viz', state.data_version)
+    return state
+
+
+def load(prefix='/'):
+    """The app's state, restored from a matching snapshot or built (and snapshotted)."""
+    data_version = datastore.current_version()
+    path = snapshot_path(data_version, prefix)
+    state = restore(path) if path else None
+    if state is None:
+        state = build(data_version, prefix)
+        if path:
+            save(state, path)
+
+    # Rendered trend figures, keyed by (county FIPS, data version)
+    state.figure_cache = FigureCache(config.FIGURE_CACHE_SIZE, config.FIGURE_CACHE_DIR,
+                                     figures.cache_version(data_version))
+    return state
+
+
+if __name__ == '__main__':
+    # Builds through the app, so the snapshot matches its URL prefix
+    import app
+    path = snapshot_path(app.get_state().data_version, app.app.config.requests_pathname_prefix)
+    if path is None or not os.path.exists(path):
+        sys.exit("No snapshot written (needs an ingested data store and APP_SNAPSHOT_DIR)")
+    print("Snapshot written to %s" % path)
@@ -0,0 +1,93 @@
+// Client-side callbacks.
+//
+// Education topics always switch in the browser: every topic's component
+// tree ships once in the 'education-content' store (see education.py). Map
+// values written to the 'choropleth-values' store recolour the map in place
+// (see choropleth.py).
+//
+// With CLIENTSIDE_SELECTION=1, the per-county lookup table ships once in the 'county-lookup' store as
+// {year, forecast, counties: {fips: [county name, state name, avg AQI, recommended county, its AQI]}},
+// where year is the year the recommendations are for (a forecast year if
+// forecast is true), so the recommendation text and header render in the browser and only the
+// trend figures are fetched from the server.
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    selection: {
+
+        // A click on the map selects the county in the dropdown, which then
+        // drives every other output
+        clickToDropdown: function(clickData) {
+            if (!clickData) {
+                return window.dash_clientside.no_update;
+            }
+            return parseInt(clickData.points[0].location, 10);
+        },
+
+        recommendation: function(fips, lookup) {
+            var row = lookup.counties[String(fips || 1001)];
+            if (!row) {
+                return [null, ""];
+            }
+            var countyName = row[0], stateName = row[1];
+            var recCounty = row[3] === null ? countyName : row[3];
+            var verb = lookup.forecast ? "is forecasted to have" : "had";
+
+            var h2 = {type: 'H2', namespace: 'dash_html_components', props: {children: 'Recommendation'}};
+            var strong = function(text) {
+                return {type: 'Strong', namespace: 'dash_html_components', props: {children: text}};
+            };
+
+            var children;
+            if (recCounty === countyName) {
+                children = [h2, "Based on your selected county, ", strong(countyName), " in ", strong(stateName),
+                            ", we recommend that you stick with your selection as it " + verb +
+                            " the lowest average AQI among its neighbouring counties in " + lookup.year + "."];
+            } else {
+                children = [h2, "Based on your selected county, ", strong(countyName), " in ", strong(stateName),
+                            ", we recommend that you also consider its neighbouring county, ", strong(recCounty),
+                            ", which " + verb + " a lower average AQI of ", String(row[4]), " in " + lookup.year + "."];
+            }
+
+            return [
+                {type: 'Div', namespace: 'dash_html_components', props: {children: children}},
+                "Historical Trends and Forecasts for " + countyName + ", " + stateName
+            ];
+        }
+    },
+
+    choropleth: {
+
+        // `values` is {z, reliability, cmax} for every county in figure
+        // order, or the same for only the counties listed in `index`
+        recolour: function(values, figure) {
+            if (!values || !figure) {
+                return window.dash_clientside.no_update;
+            }
+            var trace = Object.assign({}, figure.data[0]);
+            var z = trace.z.slice(), customdata = trace.customdata.slice();
+            var n = values.index ? values.index.length : values.z.length;
+            for (var i = 0; i < n; i++) {
+                var j = values.index ? values.index[i] : i;
+                z[j] = values.z[i];
+                if (values.reliability) {
+                    customdata[j] = [customdata[j][0], customdata[j][1], values.reliability[i]];
+                }
+            }
+            trace.z = z;
+            trace.customdata = customdata;
+
+            var layout = Object.assign({}, figure.layout);
+            if (values.cmax !== undefined) {
+                layout.coloraxis = Object.assign({}, layout.coloraxis, {cmax: values.cmax});
+            }
+            return Object.assign({}, figure, {data: [trace].concat(figure.data.slice(1)), layout: layout});
+        }
+    },
+
+    education: {
+
+        show: function(topic, content) {
+            return content[topic] || topic;
+        }
+    }
+});
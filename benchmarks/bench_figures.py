@@ -0,0 +1,86 @@
+"""Trend figure construction: plotly.express builders vs. figures.trend_figures.
+
+Run from the repository root:
+
+    python benchmarks/bench_figures.py [number of counties]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plotly.express as px
+from plotly.utils import PlotlyJSONEncoder
+
+import config
+import datastore
+import figures
+from county_index import CountyIndex
+
+
+def express_figures(dff):
+    # The per-pollutant plotly.express path that figures.trend_figures replaced
+    dff = dff[dff['date'] >= figures.FIRST_YEAR]
+    out = []
+    for _, name, title in config.TREND_POLLUTANTS:
+        fig = px.line(dff[dff["parameter_name"] == name], x="date", y="avg_aqi",
+                      title='Historical Trend & Forecast for ' + title, color="forecast",
+                      color_discrete_sequence=figures.SERIES_COLORS)
+        fig = fig.update_layout(height=450, width=500, title_x=0.5, legend_title_text="", legend_traceorder="reversed")
+        fig = fig.update_traces(mode="markers+lines", hovertemplate=figures.HOVERTEMPLATE,
+                                selector=dict(type='scatter'))
+        fig = fig.update_xaxes(title_text="Year", tickvals=[2015, 2016, 2017, 2018, 2019, 2020, 2021, 2022])
+        fig = fig.update_yaxes(title_text="Average AQI")
+        out.append(fig)
+    return out
+
+
+def serialize(figs):
+    # What Dash does with a callback's return value
+    return json.dumps(figs, cls=PlotlyJSONEncoder)
+
+
+def check(county_index, fips_codes):
+    # Both paths must draw the same series
+    for fips in fips_codes:
+        dff = county_index.history_rows(fips)
+        for old, new in zip(express_figures(dff), figures.trend_figures(dff)):
+            old_series = [(t.name, list(t.x), list(t.y)) for t in old.data]
+            new_series = [(t['name'], t['x'], t['y']) for t in new['data']]
+            assert old_series == new_series, "series differ for county %05d" % fips
+
+
+def timed(label, fn, fips_codes, county_index):
+    start = time.perf_counter()
+    for fips in fips_codes:
+        serialize(fn(county_index.history_rows(fips)))
+    elapsed = time.perf_counter() - start
+    print("%-22s %8.2f ms/county" % (label, elapsed / len(fips_codes) * 1000))
+    return elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    county_index = CountyIndex(datastore.load_table('choropleth'),
+                               datastore.load_table('supplementary_viz'),
+                               datastore.load_table('recommendations_2022'))
+    fips_codes = county_index.fips_codes()[:n]
+
+    check(county_index, fips_codes[:20])
+    print("outputs match on %d counties" % min(20, len(fips_codes)))
+    # Counties without history from FIRST_YEAR on get empty charts
+    empty = [fips for fips in county_index.fips_codes()
+             if not (county_index.history_rows(fips)['date'] >= figures.FIRST_YEAR).any()]
+    check(county_index, empty)
+    print("outputs match on %d counties without history" % len(empty))
+
+    old = timed("plotly.express", express_figures, fips_codes, county_index)
+    new = timed("trend_figures", figures.trend_figures, fips_codes, county_index)
+    timed("trend_subplots", lambda dff: [figures.trend_subplots(dff)], fips_codes, county_index)
+    print("speedup %.1fx" % (old / new))
+
+
+if __name__ == '__main__':
+    main()
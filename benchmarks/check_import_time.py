@@ -0,0 +1,76 @@
+"""Import-time budget for the app, for scale-to-zero and serverless starts.
+
+Imports the app in a few fresh processes and fails (exit status 1) when the
+median import takes longer than the budget, when importing it loaded the
+data, or when it pulled in a module that should only load on first use.
+Also reports the first layout request, which is when the data is loaded
+(restored from a snapshot when one matches, see app_state.py).
+
+Run from the repository root, e.g. in CI after `python datastore.py`:
+
+    python benchmarks/check_import_time.py [--budget 1.0] [--runs 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BUDGET_S = 1.0
+
+# Only needed once the data is loaded
+DEFERRED_MODULES = ['pandas', 'plotly.express', 'app_state', 'datastore']
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+loaded = [name for name in %r if name in sys.modules]
+state_built = app._state is not None
+app.server.test_client().get('/_dash-layout')
+print(json.dumps({'import_s': imported - start, 'first_layout_s': time.perf_counter() - imported,
+                  'loaded': loaded, 'state_built': state_built}))
+""" % DEFERRED_MODULES
+
+
+def measure(runs):
+    """Median import and first-layout times, and what the import loaded."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', IMPORT_SCRIPT], cwd=ROOT)
+        samples.append(json.loads(output.decode().strip().splitlines()[-1]))
+    return {'import_s': float(np.median([s['import_s'] for s in samples])),
+            'first_layout_s': float(np.median([s['first_layout_s'] for s in samples])),
+            'loaded': sorted({name for s in samples for name in s['loaded']}),
+            'state_built': any(s['state_built'] for s in samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_S,
+                        help="median import time allowed, in seconds (default %.1f)" % DEFAULT_BUDGET_S)
+    parser.add_argument('--runs', type=int, default=5, help="fresh imports to time (default 5)")
+    args = parser.parse_args()
+
+    result = measure(args.runs)
+    print("import       %.2f s (budget %.2f s)" % (result['import_s'], args.budget))
+    print("first layout %.2f s" % result['first_layout_s'])
+
+    failures = []
+    if result['import_s'] > args.budget:
+        failures.append("import took %.2f s, over the %.2f s budget" % (result['import_s'], args.budget))
+    if result['state_built']:
+        failures.append("importing the app loaded its data")
+    if result['loaded']:
+        failures.append("importing the app loaded %s" % ', '.join(result['loaded']))
+    if failures:
+        sys.exit('\n'.join(failures))
+
+
+if __name__ == '__main__':
+    main()
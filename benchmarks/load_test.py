@@ -0,0 +1,347 @@
+"""Load test for the Dash callbacks, driven through the Flask test client.
+
+The app is imported once and then forked into worker processes, as
+`gunicorn app:server --preload` does. Each worker runs a few client threads
+that replay a mix of map clicks and dropdown selections over every county,
+plus education tab switches if that callback runs on the server. The report
+covers latency percentiles per kind of request, throughput, per-worker
+memory, the figure cache counters and the app's startup time (import, then
+first layout request, in a fresh process).
+
+Run from the repository root, against the ingested data store:
+
+    python benchmarks/load_test.py [--workers 2] [--threads 4] [--requests 2000]
+    python benchmarks/load_test.py --save baseline      # keep the results
+    python benchmarks/load_test.py --compare baseline   # compare against them
+
+Baselines are JSON files under benchmarks/baselines/. With --compare,
+--max-regression makes the run fail when p95 latency or throughput is that
+many percent worse than the baseline. The app's settings apply as usual,
+e.g. FIGURE_CACHE_SIZE=0 FIGURE_CACHE_DIR= measures uncached rendering and
+CLIENTSIDE_SELECTION=1 the client-side selection mode. --config takes a
+gunicorn config file and runs with its workers, threads, environment
+defaults and when_ready hook, to check the serving settings:
+
+    python benchmarks/load_test.py --config gunicorn.conf.py
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+BASELINE_DIR = os.path.join(ROOT, 'benchmarks', 'baselines')
+
+# Share of each kind of request in the replayed traffic
+MIX = [('click', 0.45), ('dropdown', 0.45), ('education', 0.10)]
+
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.server.test_client().get('/_dash-layout')
+print(json.dumps({'import_s': imported - start, 'first_layout_s': time.perf_counter() - start}))
+"""
+
+DEFAULT_WORKERS = 2
+DEFAULT_THREADS = 4
+
+# Set in the parent before forking, read by the workers
+dash_app = None
+traffic = []
+
+
+##### Requests #####
+
+def find_callback(app, output):
+    """(callback map key, [(id, property) of its inputs]) of the server callback producing `output`."""
+    for key, callback in app.callback_map.items():
+        # Client-side callbacks are listed too, without a function
+        if 'callback' in callback and output in key.strip('.').split('...'):
+            return key, [(i['id'], i['property']) for i in callback['inputs']]
+    raise KeyError(output)
+
+
+def request_body(key, inputs, values, changed):
+    outputs = [dict(zip(('id', 'property'), o.split('.'))) for o in key.strip('.').split('...')]
+    return {'output': key,
+            'outputs': outputs if key.startswith('..') else outputs[0],
+            'inputs': [{'id': i, 'property': p, 'value': values.get(i + '.' + p)} for i, p in inputs],
+            'changedPropIds': [changed]}
+
+
+def build_traffic(app_module, n, seed=0):
+    """`n` (kind, request body) pairs cycling through every county in random order."""
+    rng = random.Random(seed)
+    state = app_module.get_state()
+    trend_key, trend_inputs = find_callback(app_module.app, 'trend-co.figure')
+    inputs = {i + '.' + p for i, p in trend_inputs}
+    mix = MIX
+    try:
+        education_key, education_inputs = find_callback(app_module.app, 'educate_me.children')
+        topics = [topic['value'] for topic in state.education_topics]
+    except KeyError:
+        # Topics switch in the browser, no requests to replay
+        mix = [(kind, weight) for kind, weight in MIX if kind != 'education']
+
+    fips_codes = state.county_index.fips_codes()
+    rng.shuffle(fips_codes)
+    kinds, weights = zip(*mix)
+
+    out = []
+    for i in range(n):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'education':
+            out.append((kind, request_body(education_key, education_inputs,
+                                           {'education.value': rng.choice(topics)}, 'education.value')))
+            continue
+
+        fips = fips_codes[i % len(fips_codes)]
+        county = state.county_index.county(fips)
+        values = {'dropdown.value': fips}
+        changed = 'dropdown.value'
+        # In client-side mode a map click reaches the server as a dropdown change
+        if kind == 'click' and 'choropleth.clickData' in inputs:
+            values['choropleth.clickData'] = {'points': [{
+                'location': '%05d' % fips, 'z': county['avg_aqi'],
+                'customdata': [county['county_name'], county['state_name'], 1.0]}]}
+            changed = 'choropleth.clickData'
+        out.append((kind, request_body(trend_key, trend_inputs, values, changed)))
+    return out
+
+
+##### Workers #####
+
+def memory():
+    """Resident and proportional set size of this process in MB (PSS on Linux only)."""
+    out = {'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 'pss_mb': None}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                if name in ('Rss', 'Pss'):
+                    out[name.lower() + '_mb'] = int(value.split()[0]) / 1024.0
+    except OSError:
+        pass
+    return out
+
+
+def tmpfs_mb(path):
+    """Size in MB of the files under `path` if it lives on tmpfs (and so in RAM), else 0."""
+    path = os.path.realpath(path)
+    mount, fstype = '', None
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                _, point, kind = line.split()[:3]
+                if (path == point or path.startswith(point.rstrip('/') + '/')) and len(point) > len(mount):
+                    mount, fstype = point, kind
+    except OSError:
+        return 0.0
+    if fstype != 'tmpfs':
+        return 0.0
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names) / 1024.0 / 1024.0
+
+
+def run_worker(args):
+    worker, workers, threads = args
+    requests = traffic[worker::workers]
+    timings = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(thread):
+        test_client = dash_app.server.test_client()
+        for kind, body in requests[thread::threads]:
+            start = time.perf_counter()
+            response = test_client.post('/_dash-update-component', json=body)
+            elapsed = time.perf_counter() - start
+            with lock:
+                timings.append((kind, elapsed, len(response.data)))
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=client, args=(t,)) for t in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    cache = sys.modules['app'].get_state().figure_cache
+    return {'timings': timings, 'errors': errors, 'elapsed_s': elapsed, 'memory': memory(),
+            'cache': {'hits': cache.hits, 'disk_hits': cache.disk_hits, 'misses': cache.misses}}
+
+
+##### Report #####
+
+def latency(values):
+    ms = np.asarray(values) * 1000
+    return {'count': len(ms),
+            'p50_ms': float(np.percentile(ms, 50)),
+            'p95_ms': float(np.percentile(ms, 95)),
+            'p99_ms': float(np.percentile(ms, 99)),
+            'mean_ms': float(ms.mean())}
+
+
+def startup(runs):
+    """Median import and first-layout times of the app in fresh processes."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT], cwd=ROOT)
+        samples.append(json.loads(output.decode().strip().splitlines()[-1]))
+    return {name: float(np.median([s[name] for s in samples])) for name in samples[0]}
+
+
+def serving_config(path):
+    """The settings defined by a gunicorn config file."""
+    settings = {}
+    with open(path) as f:
+        exec(compile(f.read(), path, 'exec'), settings)
+    return settings
+
+
+def run(workers, threads, n, startup_runs, seed=0, serving=None):
+    global dash_app, traffic
+    serving = serving or {}
+    for line in serving.get('raw_env', []):
+        name, value = line.split('=', 1)
+        os.environ[name] = value
+    results = {'startup': startup(startup_runs) if startup_runs else None}
+
+    import app
+    dash_app = app.app
+    traffic = build_traffic(app, n, seed)
+    if 'when_ready' in serving:
+        # The workers below are forked from this process, as with preload_app
+        serving['when_ready'](types.SimpleNamespace(cfg=types.SimpleNamespace(preload_app=True)))
+    results['preload_memory'] = memory()
+
+    context = multiprocessing.get_context('fork')
+    start = time.perf_counter()
+    with context.Pool(workers) as pool:
+        per_worker = pool.map(run_worker, [(w, workers, threads) for w in range(workers)])
+    wall = time.perf_counter() - start
+
+    timings = [t for w in per_worker for t in w['timings']]
+    results['latency'] = {'all': latency([t[1] for t in timings])}
+    for kind, _ in MIX:
+        values = [t[1] for t in timings if t[0] == kind]
+        if values:
+            results['latency'][kind] = latency(values)
+    results['throughput_rps'] = len(timings) / wall
+    results['errors'] = sum(len(w['errors']) for w in per_worker)
+    results['response_kb'] = sum(t[2] for t in timings) / 1024.0 / max(len(timings), 1)
+    results['workers'] = [dict(w['memory'], cache=w['cache'], elapsed_s=w['elapsed_s']) for w in per_worker]
+    # Requests per second per GB of worker memory (proportional, so shared
+    # pages count once), plus the figure cache's shared tier when it is held
+    # in RAM (tmpfs, e.g. /dev/shm)
+    cache = app.get_state().figure_cache
+    results['shared_cache_mb'] = tmpfs_mb(cache.disk_path(cache.version)) if cache.disk_dir and cache.version else 0.0
+    total_mb = sum(w['pss_mb'] or w['rss_mb'] for w in results['workers']) + results['shared_cache_mb']
+    results['rps_per_gb'] = results['throughput_rps'] / (total_mb / 1024.0)
+    return results
+
+
+def print_report(results):
+    if results['startup']:
+        print("startup     import %.2f s, first layout %.2f s" % (results['startup']['import_s'],
+                                                                  results['startup']['first_layout_s']))
+    print("%-10s %7s %9s %9s %9s %9s" % ('request', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'mean ms'))
+    for kind, stats in results['latency'].items():
+        print("%-10s %7d %9.2f %9.2f %9.2f %9.2f" % (kind, stats['count'], stats['p50_ms'], stats['p95_ms'],
+                                                     stats['p99_ms'], stats['mean_ms']))
+    print("throughput  %.1f requests/s, %.1f kB/response, %d errors" % (
+        results['throughput_rps'], results['response_kb'], results['errors']))
+    print("memory      %.1f requests/s per GB, preload rss %.0f MB, shared cache in RAM %.0f MB" % (
+        results['rps_per_gb'], results['preload_memory']['rss_mb'], results.get('shared_cache_mb', 0.0)))
+    for i, worker in enumerate(results['workers']):
+        pss = '' if worker['pss_mb'] is None else ', pss %.0f MB' % worker['pss_mb']
+        print("worker %-4d rss %.0f MB%s, cache %d hits / %d disk / %d misses" % (
+            i, worker['rss_mb'], pss, worker['cache']['hits'], worker['cache']['disk_hits'],
+            worker['cache']['misses']))
+
+
+def compare(results, baseline, max_regression=None):
+    """Print the change against a baseline; False if a limit is exceeded."""
+    rows = [('startup import s', lambda r: r['startup'] and r['startup']['import_s'], False),
+            ('p50 ms', lambda r: r['latency']['all']['p50_ms'], False),
+            ('p95 ms', lambda r: r['latency']['all']['p95_ms'], False),
+            ('p99 ms', lambda r: r['latency']['all']['p99_ms'], False),
+            ('throughput rps', lambda r: r['throughput_rps'], True),
+            ('rps per GB', lambda r: r.get('rps_per_gb'), True),
+            ('max worker rss MB', lambda r: max(w['rss_mb'] for w in r['workers']), False)]
+    ok = True
+    print("\n%-18s %10s %10s %8s" % ('vs. baseline', 'baseline', 'current', 'change'))
+    for label, value, higher_is_better in rows:
+        old, new = value(baseline['results']), value(results)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        print("%-18s %10.2f %10.2f %+7.1f%%" % (label, old, new, change))
+        worse = -change if higher_is_better else change
+        if max_regression is not None and label in ('p95 ms', 'throughput rps') and worse > max_regression:
+            ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, help="worker processes (default %d)" % DEFAULT_WORKERS)
+    parser.add_argument('--threads', type=int, help="client threads per worker (default %d)" % DEFAULT_THREADS)
+    parser.add_argument('--config', metavar='PATH', help="run with the settings of a gunicorn config file")
+    parser.add_argument('--requests', type=int, default=2000, help="requests in total (default 2000)")
+    parser.add_argument('--startup-runs', type=int, default=3, help="fresh imports to time (0 to skip)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='NAME', help="save the results as a baseline")
+    parser.add_argument('--compare', metavar='NAME', help="compare with a saved baseline")
+    parser.add_argument('--max-regression', type=float, metavar='PERCENT',
+                        help="with --compare, fail if p95 or throughput is this much worse")
+    args = parser.parse_args()
+
+    serving = serving_config(args.config) if args.config else {}
+    args.workers = args.workers or serving.get('workers', DEFAULT_WORKERS)
+    args.threads = args.threads or serving.get('threads', DEFAULT_THREADS)
+    results = run(args.workers, args.threads, args.requests, args.startup_runs, args.seed, serving)
+    print_report(results)
+
+    settings = {name: getattr(args, name) for name in ('workers', 'threads', 'requests', 'seed', 'config')}
+    ok = True
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, args.compare + '.json')) as f:
+            baseline = json.load(f)
+        if baseline['settings'] != settings:
+            print("note: baseline was run with %s" % baseline['settings'])
+        ok = compare(results, baseline, args.max_regression)
+
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, args.save + '.json')
+        with open(path, 'w') as f:
+            json.dump({'settings': settings,
+                       'environment': {'python': platform.python_version(), 'machine': platform.machine(),
+                                       'cpus': os.cpu_count(), 'saved': time.strftime('%Y-%m-%d %H:%M:%S')},
+                       'results': results}, f, indent=2)
+        print("saved %s" % os.path.relpath(path, ROOT))
+
+    if not ok:
+        sys.exit("regression over %.0f%% against %s" % (args.max_regression, args.compare))
+
+
+if __name__ == '__main__':
+    main()
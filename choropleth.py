@@ -0,0 +1,71 @@
+import numpy as np
+import plotly.colors
+
+from figures import TEMPLATE
+
+# The county choropleth, with the geometry kept out of the figure.
+#
+# The trace points at the county GeoJSON by URL (served as a precompressed,
+# cacheable asset, see geo.serve_counties), so the figure only carries the
+# county locations, labels and values. Values are aligned to the order of
+# df_choro and can be replaced in the browser, in full or as a delta of the
+# changed counties, by writing to the 'choropleth-values' store (see
+# choropleth.recolour in assets/clientside.js).
+
+# plotly.express' "matter" scale, spread evenly over [0, 1]
+COLORSCALE = [[i / (len(plotly.colors.sequential.matter) - 1), color]
+              for i, color in enumerate(plotly.colors.sequential.matter)]
+HOVERTEMPLATE = "%{customdata[0]}, %{customdata[1]}<br>Average AQI: %{z:.2f} <br>Reliability Score: %{customdata[2]:.0%}"
+
+
+def _floats(values, decimals):
+    # JSON-ready list, missing values as null
+    values = np.round(np.asarray(values, dtype=float), decimals)
+    return [None if v != v else v for v in values.tolist()]
+
+
+def values(avg_aqi, reliability):
+    """The per-county values of the map: colour, reliability and colour range."""
+    avg_aqi = np.asarray(avg_aqi, dtype=float)
+    return {'z': _floats(avg_aqi, 2),
+            'reliability': _floats(reliability, 4),
+            'cmax': int(round(np.nanmax(avg_aqi))) if np.isfinite(avg_aqi).any() else 0}
+
+
+def values_delta(old, new):
+    """Sparse update from `old` to `new` values: only the counties that changed."""
+    changed = [i for i, (a, b, c, d) in enumerate(zip(old['z'], new['z'], old['reliability'], new['reliability']))
+               if a != b or c != d]
+    return {'index': changed,
+            'z': [new['z'][i] for i in changed],
+            'reliability': [new['reliability'][i] for i in changed],
+            'cmax': new['cmax']}
+
+
+def figure(df_choro, geojson):
+    """Choropleth of df_choro's avg_aqi; `geojson` is the geometry or its URL."""
+    current = values(df_choro['avg_aqi'], df_choro['reliability'])
+    customdata = [[county, state, reliability]
+                  for county, state, reliability in zip(df_choro['county_name'].astype(str),
+                                                        df_choro['state_name'].astype(str),
+                                                        current['reliability'])]
+    return {
+        'data': [{'type': 'choropleth',
+                  'geojson': geojson,
+                  'locations': ['%05d' % code for code in df_choro['fips_code'].tolist()],
+                  'z': current['z'],
+                  'customdata': customdata,
+                  'coloraxis': 'coloraxis',
+                  'geo': 'geo',
+                  'name': '',
+                  'hovertemplate': HOVERTEMPLATE}],
+        'layout': {'template': TEMPLATE,
+                   'geo': {'domain': {'x': [0.0, 1.0], 'y': [0.0, 1.0]}, 'center': {}, 'scope': 'usa'},
+                   'coloraxis': {'colorbar': {'title': {'text': 'AQI'}},
+                                 'colorscale': COLORSCALE,
+                                 'cmin': 0,
+                                 'cmax': current['cmax']},
+                   'legend': {'tracegroupgap': 0},
+                   'margin': {'r': 0, 't': 0, 'l': 0, 'b': 0},
+                   'height': 500},
+    }
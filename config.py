@@ -0,0 +1,67 @@
+import json
+import os
+
+##### Paths and runtime settings #####
+
+# Everything can be overridden through environment variables so the same
+# code runs on Heroku, in gunicorn and locally without edits.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get('APP_DATA_DIR', os.path.join(BASE_DIR, 'data'))
+
+# Raw EPA daily files read by ingest.py
+RAW_DIR = os.environ.get('APP_RAW_DIR', os.path.join(DATA_DIR, 'raw'))
+
+# Local on-disk cache (decompressed geometry, built artefacts)
+CACHE_DIR = os.environ.get('APP_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'choropleth-air-pollutants'))
+
+# County geometry
+GEO_DIR = os.path.join(DATA_DIR, 'geo')
+GEO_LEVEL = os.environ.get('GEO_LEVEL', 'z1')
+
+# Trend figure cache: in-process LRU size and the shared on-disk tier
+# (set FIGURE_CACHE_DIR to an empty string to keep it memory-only)
+FIGURE_CACHE_SIZE = int(os.environ.get('FIGURE_CACHE_SIZE', 512))
+FIGURE_CACHE_DIR = os.environ.get('FIGURE_CACHE_DIR', os.path.join(CACHE_DIR, 'figures'))
+
+# Figure builds run on a pool of this many threads per process, and
+# concurrent requests for the same county share one build (0: build inline)
+FIGURE_BUILD_THREADS = int(os.environ.get('FIGURE_BUILD_THREADS', 2))
+
+# Snapshots of the app's derived state (lookups, map layers, layout data),
+# restored on start instead of rebuilt (empty to always build, see app_state.py)
+APP_SNAPSHOT_DIR = os.environ.get('APP_SNAPSHOT_DIR', os.path.join(CACHE_DIR, 'snapshots'))
+
+# Render the recommendation text and header in the browser from a lookup
+# table shipped with the page; only trend figures go through the server
+CLIENTSIDE_SELECTION = os.environ.get('CLIENTSIDE_SELECTION', '0') == '1'
+
+# Compute recommendations in the app instead of using recommendations_2022:
+# best county within RECOMMENDATION_K steps for RECOMMENDATION_YEAR of the
+# history, pollutants weighted by RECOMMENDATION_WEIGHTS (JSON object of
+# parameter_name -> weight, all equal by default)
+RECOMMENDATION_YEAR = int(os.environ['RECOMMENDATION_YEAR']) if os.environ.get('RECOMMENDATION_YEAR') else None
+RECOMMENDATION_K = int(os.environ.get('RECOMMENDATION_K', 1))
+RECOMMENDATION_WEIGHTS = json.loads(os.environ['RECOMMENDATION_WEIGHTS']) if os.environ.get('RECOMMENDATION_WEIGHTS') else None
+
+# Forecasts appended to the history by forecast.py / ingest.py: years ahead,
+# model ('linear' or 'holt') and how many past years each series is fit on
+FORECAST_HORIZON = int(os.environ.get('FORECAST_HORIZON', 2))
+FORECAST_METHOD = os.environ.get('FORECAST_METHOD', 'linear')
+FORECAST_WINDOW = int(os.environ.get('FORECAST_WINDOW', 10))
+
+# Request timing and counters served at METRICS_PATH (empty to turn off),
+# and the interval of the optional sampling profiler (0 to turn off)
+METRICS_PATH = os.environ.get('METRICS_PATH', '/metrics')
+PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', 0))
+
+# Pollutants plotted under the map: (graph id suffix, parameter_name in the
+# history table, display name). Adding a row adds a trend graph.
+TREND_POLLUTANTS = [
+    ('co', 'Carbon monoxide', 'Carbon Monoxide'),
+    ('ozone', 'Ozone', 'Ozone'),
+    ('no2', 'Nitrogen dioxide (NO2)', 'Nitrogen Dioxide'),
+    ('so2', 'Sulfur dioxide', 'Sulfur Dioxide'),
+    ('pm', 'PM2.5 - Local Conditions', 'PM2.5'),
+]
@@ -0,0 +1,76 @@
+import numpy as np
+
+# Per-county lookups for the callbacks, built once at load.
+#
+# The history table is kept sorted by FIPS code so a county's rows are one
+# contiguous slice, and everything else a click needs (names, average AQI,
+# recommended neighbour) is a plain dict keyed by integer FIPS code.
+
+
+class CountyIndex:
+
+    def __init__(self, df_choro, df_supp, df_rec):
+        # Sort only if needed, so a history table that is already ordered
+        # (as written by datastore.py) stays memory-mapped
+        if not df_supp['fips_code'].is_monotonic_increasing:
+            df_supp = df_supp.sort_values('fips_code', kind='mergesort').reset_index(drop=True)
+        self.history = df_supp
+
+        fips, starts = np.unique(df_supp['fips_code'].to_numpy(), return_index=True)
+        stops = np.append(starts[1:], len(df_supp))
+        self._slices = {code: (start, stop)
+                        for code, start, stop in zip(fips.tolist(), starts.tolist(), stops.tolist())}
+
+        self._counties = {}
+        for code, county_name, state_name, avg_aqi in zip(df_choro['fips_code'].tolist(),
+                                                          df_choro['county_name'].astype(str),
+                                                          df_choro['state_name'].astype(str),
+                                                          df_choro['avg_aqi'].tolist()):
+            self._counties[code] = {'county_name': county_name,
+                                    'state_name': state_name,
+                                    'avg_aqi': avg_aqi}
+
+        self._recommendations = {}
+        for code, rec_fips, rec_county_name, rec_avg_aqi in zip(df_rec['source_fips'].tolist(),
+                                                                df_rec['adj_fips'].tolist(),
+                                                                df_rec['rec_county_name'].astype(str),
+                                                                df_rec['rec_avg_aqi'].tolist()):
+            self._recommendations[code] = {'rec_fips': rec_fips,
+                                           'rec_county_name': rec_county_name,
+                                           'rec_avg_aqi': rec_avg_aqi}
+
+    def __contains__(self, fips):
+        return fips in self._counties
+
+    def fips_codes(self):
+        return list(self._counties)
+
+    def county(self, fips):
+        """County name, state name and average AQI, or None if unknown."""
+        return self._counties.get(fips)
+
+    def recommendation(self, fips):
+        """Recommended neighbour (FIPS, name) and its forecast AQI, or None if unknown."""
+        return self._recommendations.get(fips)
+
+    def client_table(self):
+        """Compact {fips: [county, state, AQI, recommended county, its AQI]} for the browser."""
+        table = {}
+        for code, county in self._counties.items():
+            rec = self._recommendations.get(code, {'rec_county_name': None, 'rec_avg_aqi': None})
+            table[str(code)] = [county['county_name'], county['state_name'], round(county['avg_aqi'], 2),
+                                rec['rec_county_name'],
+                                None if rec['rec_avg_aqi'] is None else round(rec['rec_avg_aqi'], 2)]
+        return table
+
+    def history_positions(self, fips_codes):
+        """Row positions of several counties in the history table, county after county."""
+        slices = np.array([self._slices[code] for code in fips_codes if code in self._slices],
+                          dtype=np.int64).reshape(-1, 2)
+        counts = slices[:, 1] - slices[:, 0]
+        return np.repeat(slices[:, 0] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    def history_rows(self, fips):
+        """The county's rows of the history table (empty if unknown)."""
+        start, stop = self._slices.get(fips, (0, 0))
+        return self.history.iloc[start:stop]
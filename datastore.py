@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+import config
+from fileutil import atomic_write
+
+# Columnar, memory-mappable copy of the CSV tables.
+#
+# `python datastore.py` converts the source CSVs under data/ into one .npy
+# file per column in data/store/<version>/<table>/ and points
+# data/store/CURRENT at the new version. Text columns are stored as integer
+# codes plus their categories, FIPS codes as integers. load_table() maps the
+# columns read-only, categorical codes included, so gunicorn workers share
+# the pages through the OS page cache instead of each parsing its own copy
+# of the CSVs. Only the (small) category lists are read into each process.
+
+# Table name -> source file and column types. Columns not listed are dropped.
+TABLES = {
+    'choropleth': {
+        'source': 'choropleth_data.csv',
+        'columns': {'fips_code': 'int32', 'county_name': 'category', 'state_fips': 'int8',
+                    'state_name': 'category', 'avg_aqi': 'float64', 'counties': 'int32',
+                    'counties_monitors': 'int32', 'reliability': 'float64'},
+    },
+    'supplementary_viz': {
+        'source': 'supplementary_viz.csv',
+        'columns': {'fips_code': 'int32', 'county_name': 'category', 'state_name': 'category',
+                    'parameter_name': 'category', 'date': 'int16', 'avg_aqi': 'float64',
+                    'forecast': 'category'},
+        # Sorted so each county's history is one contiguous slice
+        'sort': ['fips_code', 'date'],
+    },
+    'recommendations_2022': {
+        'source': 'recommendations_2022.csv',
+        'columns': {'Source County': 'category', 'source_fips': 'int32', 'adj_fips': 'int32',
+                    'source_state': 'int8', 'rec_county_name': 'category', 'rec_avg_aqi': 'float64'},
+    },
+}
+
+META = '_meta.json'
+
+# The source CSVs list the 3,143 counties of the county file the original
+# map used. The bundled geometry (Census cb_2016, see geo.py) has two of
+# them under new codes and names, and no longer has Bedford city, VA, which
+# joined Bedford County in 2013. read_source() moves the CSVs onto the
+# geometry's codes: renamed counties get their new code and name, and the
+# rows of a merged county are dropped (the county it joined has its own).
+FIPS_CHANGES = {2270: (2158, 'Kusilvak Census Area'),    # Wade Hampton Census Area, AK
+                46113: (46102, 'Oglala Lakota County')}  # Shannon County, SD
+FIPS_MERGED = {51515: 51019}                             # Bedford city -> Bedford County, VA
+
+# Part of the store version: bumped whenever read_source() changes what it
+# makes of the same CSVs
+SOURCE_FORMAT = 2
+
+
+def store_dir(data_dir=None):
+    return os.path.join(data_dir or config.DATA_DIR, 'store')
+
+
+def current_version(data_dir=None):
+    """Version of the active store, or None if nothing has been ingested."""
+    try:
+        with open(os.path.join(store_dir(data_dir), 'CURRENT')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+##### Reading #####
+
+def _read_csv(path, columns):
+    # Text columns are read as str so FIPS codes keep their leading zeros
+    # until they are converted explicitly below.
+    df = pd.read_csv(path, usecols=list(columns), dtype=str)
+    out = {}
+    for name, kind in columns.items():
+        if kind == 'category':
+            out[name] = df[name].astype('category')
+        else:
+            out[name] = pd.to_numeric(df[name]).astype(kind)
+    return pd.DataFrame(out, columns=list(columns))
+
+
+def _rename(df, fips_column, name_column, suffix=False):
+    # New names for the counties in FIPS_CHANGES (keeping a ", ST" suffix)
+    fips = df[fips_column].to_numpy()
+    names = np.array(df[name_column].astype(str), dtype=object)
+    for code, (_, county_name) in FIPS_CHANGES.items():
+        at = fips == code
+        names[at] = [county_name + (name[name.rfind(','):] if suffix and ',' in name else '') for name in names[at]]
+    return pd.Categorical(names)
+
+
+def geometry_counties(name, df):
+    """Table `name` with its counties moved onto the codes of the bundled geometry."""
+    codes = {old: new for old, (new, _) in FIPS_CHANGES.items()}
+    codes.update(FIPS_MERGED)
+    df = df.copy()
+    if name == 'recommendations_2022':
+        df = df[~df['source_fips'].isin(list(FIPS_MERGED))]
+        df['Source County'] = _rename(df, 'source_fips', 'Source County', suffix=True)
+        df['rec_county_name'] = _rename(df, 'adj_fips', 'rec_county_name')
+        for column in ('source_fips', 'adj_fips'):
+            df[column] = df[column].replace(codes).astype(df[column].dtype)
+    else:
+        df = df[~df['fips_code'].isin(list(FIPS_MERGED))]
+        df['county_name'] = _rename(df, 'fips_code', 'county_name')
+        df['fips_code'] = df['fips_code'].replace(codes).astype(df['fips_code'].dtype)
+    return df.reset_index(drop=True)
+
+
+def read_source(name, data_dir=None):
+    """Parse a table straight from its CSV, typed like the columnar store."""
+    table = TABLES[name]
+    df = _read_csv(os.path.join(data_dir or config.DATA_DIR, table['source']), table['columns'])
+    return geometry_counties(name, df)
+
+
+def load_table(name, version=None, data_dir=None):
+    """Map a table from the columnar store, falling back to its CSV."""
+    version = version or current_version(data_dir)
+    path = os.path.join(store_dir(data_dir), version or '', name)
+    if version is None or not os.path.exists(os.path.join(path, META)):
+        return read_source(name, data_dir)
+
+    with open(os.path.join(path, META)) as f:
+        meta = json.load(f)
+
+    columns = {}
+    for column in meta['columns']:
+        values = np.load(os.path.join(path, column['file']), mmap_mode='r')
+        if 'categories' in column:
+            values = _categorical(values, column['categories'])
+        columns[column['name']] = values
+    return pd.DataFrame(columns, columns=[c['name'] for c in meta['columns']], copy=False)
+
+
+def _categorical(codes, categories):
+    # The categorical keeps the mapped codes as they are (they were written
+    # with the dtype pandas picks for that many categories). They are known
+    # to be valid, so skip the scan over them where pandas allows it.
+    try:
+        return pd.Categorical.from_codes(codes, categories, validate=False)
+    except TypeError:
+        # pandas < 2.1 always validates (a read of the codes, not a copy)
+        return pd.Categorical.from_codes(codes, categories)
+
+
+##### Writing #####
+
+def _write_table(df, path):
+    os.makedirs(path, exist_ok=True)
+    meta = {'rows': len(df), 'columns': []}
+    for i, name in enumerate(df.columns):
+        column = {'name': name, 'file': '%02d.npy' % i}
+        values = df[name]
+        if hasattr(values, 'cat'):
+            column['categories'] = list(values.cat.categories)
+            values = values.cat.codes
+        np.save(os.path.join(path, column['file']), np.ascontiguousarray(values.to_numpy()))
+        meta['columns'].append(column)
+    with open(os.path.join(path, META), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def _checksum(paths):
+    digest = hashlib.sha256(b'source-format-%d' % SOURCE_FORMAT)
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def typed(name, df):
+    """Cast a frame to the store schema of table `name` (and sort it if required)."""
+    table = TABLES[name]
+    df = pd.DataFrame({column: df[column].astype(kind) for column, kind in table['columns'].items()},
+                      columns=list(table['columns']))
+    if 'sort' in table:
+        df = df.sort_values(table['sort'], kind='mergesort').reset_index(drop=True)
+    return df
+
+
+def publish(tables, version, data_dir=None):
+    """Write {table name: frame} as store `version` and make it current."""
+    data_dir = data_dir or config.DATA_DIR
+    root = os.path.join(store_dir(data_dir), version)
+
+    # Write into a temporary directory and switch CURRENT only once every
+    # table is complete, so a running app never sees a half-written store.
+    tmp_root = root + '.tmp'
+    shutil.rmtree(tmp_root, ignore_errors=True)
+    for name in sorted(tables):
+        df = typed(name, tables[name])
+        _write_table(df, os.path.join(tmp_root, name))
+        print("%s: %d rows" % (name, len(df)))
+    shutil.rmtree(root, ignore_errors=True)
+    os.replace(tmp_root, root)
+
+    with atomic_write(os.path.join(store_dir(data_dir), 'CURRENT'), 'w') as f:
+        f.write(version)
+    print("Store version %s" % version)
+    return version
+
+
+def ingest(data_dir=None):
+    """Convert every source CSV present into a new store version."""
+    data_dir = data_dir or config.DATA_DIR
+    sources = {name: os.path.join(data_dir, table['source'])
+               for name, table in TABLES.items()
+               if os.path.exists(os.path.join(data_dir, table['source']))}
+    version = _checksum([sources[name] for name in sorted(sources)])
+
+    if current_version(data_dir) == version and os.path.isdir(os.path.join(store_dir(data_dir), version)):
+        print("Store is up to date (%s)" % version)
+        return version
+
+    return publish({name: read_source(name, data_dir) for name in sources}, version, data_dir)
+
+
+if __name__ == '__main__':
+    ingest(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,61 @@
+import json
+import os
+
+import dash_html_components as html
+from plotly.utils import PlotlyJSONEncoder
+
+import config
+
+# Educational content shown under the trend graphs.
+#
+# The topics are data (data/education.json): each has the radio button
+# value and label, a title and a list of blocks, one key per block:
+#
+#     {"h3": "heading"}            {"p": "paragraph"}
+#     {"ul": ["item", ...]}        {"source": "url"}  (the italic reference line)
+#     {"table": [{"cells": [...], "header": true, "style": {...}}, ...]}
+#
+# The registry is compiled to serialized component trees once at startup and
+# shipped with the page, where a client-side callback swaps topics. Adding a
+# topic is an edit to the JSON file.
+
+PATH = os.path.join(config.DATA_DIR, 'education.json')
+
+
+def load_topics(path=None):
+    with open(path or PATH, encoding='utf-8') as f:
+        return json.load(f)['topics']
+
+
+def _block(block):
+    if 'h3' in block:
+        return html.H3(block['h3'])
+    if 'p' in block:
+        return html.P(block['p'])
+    if 'ul' in block:
+        return html.Ul([html.Li(item) for item in block['ul']])
+    if 'source' in block:
+        return html.P("Referenced from " + block['source'], style={"font-style": "italic"})
+    if 'table' in block:
+        rows = []
+        for row in block['table']:
+            cell = html.Th if row.get('header') else html.Td
+            rows.append(html.Tr([cell(text) for text in row['cells']], style=row.get('style')))
+        return html.Table(rows)
+    raise ValueError("Unknown education block %r" % sorted(block))
+
+
+def component(topic):
+    """The html.Div shown for one topic."""
+    return html.Div([html.H2(topic['title'])] + [_block(block) for block in topic['blocks']])
+
+
+def options(topics):
+    """RadioItems options for the topics, in registry order."""
+    return [{'label': topic['label'], 'value': topic['value']} for topic in topics]
+
+
+def compile_topics(topics):
+    """{topic value: serialized component tree}, for the 'education-content' store."""
+    return {topic['value']: json.loads(json.dumps(component(topic), cls=PlotlyJSONEncoder))
+            for topic in topics}
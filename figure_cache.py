@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from fileutil import atomic_write
+
+# Two-tier cache for rendered figures.
+#
+# The first tier is a bounded in-process LRU. The optional second tier is a
+# directory of JSON files, one per key, shared by every worker on the host
+# (and filled ahead of time by `python figures.py warm`). Keys are
+# (county FIPS, data version) tuples, so a new data store never serves
+# figures rendered from the previous one.
+
+
+class FigureCache:
+
+    def __init__(self, maxsize, disk_dir=None, version=None):
+        self.maxsize = maxsize
+        self.disk_dir = disk_dir or None
+        self.version = version
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def disk_path(self, version, fips=None):
+        path = os.path.join(self.disk_dir, str(version))
+        if fips is None:
+            return path
+        return os.path.join(path, '%05d.json' % fips)
+
+    def on_disk(self, key):
+        fips, version = key
+        return self.disk_dir is not None and os.path.exists(self.disk_path(version, fips))
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+        self._write_disk(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def prune(self):
+        """Delete the disk tier's figures for every version but this cache's own."""
+        if self.disk_dir is None or self.version is None:
+            return
+        try:
+            versions = os.listdir(self.disk_dir)
+        except OSError:
+            return
+        for version in versions:
+            if version != str(self.version):
+                shutil.rmtree(self.disk_path(version), ignore_errors=True)
+
+    def _remember(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def _read_disk(self, key):
+        fips, version = key
+        if self.disk_dir is None or version is None:
+            return None
+        try:
+            with open(self.disk_path(version, fips)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # Missing or half-written file: treat as a miss
+            return None
+
+    def _write_disk(self, key, value):
+        fips, version = key
+        if self.disk_dir is None or version is None:
+            return
+        path = self.disk_path(version, fips)
+        try:
+            # Other workers never read a partial file
+            with atomic_write(path, 'w') as f:
+                json.dump(value, f, separators=(',', ':'))
+        except OSError:
+            pass
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import plotly.io as pio
+
+import config
+import metrics
+from figure_cache import FigureCache
+
+# Historical trend & forecast figures shown under the map, one per pollutant.
+#
+# The figures are emitted directly as plain dicts from NumPy arrays: a
+# county's rows are grouped by pollutant and series in one pass, and each
+# group becomes one scatter trace. The output matches what the previous
+# plotly.express builders produced, without their per-call overhead.
+
+# Bumped whenever the figure layout changes, so cached bundles are rebuilt
+BUNDLE_FORMAT = 2
+
+FIRST_YEAR = 2015
+SERIES_COLORS = ["red", "blue"]
+HOVERTEMPLATE = "Average AQI: %{y:.2f}" + "<br>Year: %{x}"
+
+# The default Plotly theme, resolved once instead of per figure
+TEMPLATE = pio.templates[pio.templates.default].to_plotly_json()
+
+
+def cache_version(data_version):
+    """Figure cache version for a data store version (None disables the disk tier).
+
+    The plotted pollutants and first year are part of it: they decide what
+    a bundle holds, and the disk tier outlives a change of settings.
+    """
+    if data_version is None:
+        return None
+    settings = json.dumps([config.TREND_POLLUTANTS, FIRST_YEAR])
+    return '%s-f%d-%s' % (data_version, BUNDLE_FORMAT, hashlib.sha256(settings.encode('utf-8')).hexdigest()[:8])
+
+
+##### Grouping #####
+
+def _group(dff, pollutants, first_year):
+    # {parameter_name: [(series name, x, y), ...]} with series in order of
+    # first appearance, the same order plotly.express assigns colours in.
+    date = dff['date'].to_numpy()
+    keep = date >= first_year
+    date = date[keep]
+    aqi = dff['avg_aqi'].to_numpy()[keep]
+    parameter = np.asarray(dff['parameter_name'].astype(str))[keep]
+    series = np.asarray(dff['forecast'].astype(str))[keep]
+    if not len(date):
+        # No history from first_year on: empty charts
+        return {name: [] for name in pollutants}
+
+    # Stable sort by (pollutant, series) keeps rows in date order within a group
+    order = np.lexsort((series, parameter))
+    parameter, series, date, aqi = parameter[order], series[order], date[order], aqi[order]
+    first_row = np.flatnonzero(np.r_[True, (parameter[1:] != parameter[:-1]) | (series[1:] != series[:-1])])
+    bounds = np.append(first_row, len(order))
+
+    groups = {name: [] for name in pollutants}
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if parameter[start] in groups:
+            groups[parameter[start]].append((order[start], series[start], date[start:stop], aqi[start:stop]))
+    return {name: [(s, x, y) for _, s, x, y in sorted(traces, key=lambda t: t[0])]
+            for name, traces in groups.items()}
+
+
+def _traces(traces, xaxis='x', yaxis='y', showlegend=True):
+    return [{'type': 'scatter',
+             'mode': 'markers+lines',
+             'name': name,
+             'legendgroup': name,
+             'showlegend': showlegend,
+             'x': x.tolist(),
+             'y': y.tolist(),
+             'xaxis': xaxis,
+             'yaxis': yaxis,
+             'orientation': 'v',
+             'line': {'color': SERIES_COLORS[i % len(SERIES_COLORS)], 'dash': 'solid'},
+             'marker': {'symbol': 'circle'},
+             'hovertemplate': HOVERTEMPLATE}
+            for i, (name, x, y) in enumerate(traces)]
+
+
+def _tickvals(first_year, groups):
+    last = max([int(x[-1]) for traces in groups.values() for _, x, _ in traces if len(x)] or [first_year])
+    return list(range(first_year, max(last, 2022) + 1))
+
+
+##### Figures #####
+
+def trend_figures(dff, pollutants=None, first_year=FIRST_YEAR):
+    """One trend figure per pollutant, as plain dicts."""
+    pollutants = pollutants or config.TREND_POLLUTANTS
+    groups = _group(dff, [name for _, name, _ in pollutants], first_year)
+    tickvals = _tickvals(first_year, groups)
+
+    figures = []
+    for _, name, title in pollutants:
+        figures.append({
+            'data': _traces(groups[name]),
+            'layout': {'template': TEMPLATE,
+                       'title': {'text': 'Historical Trend & Forecast for ' + title, 'x': 0.5},
+                       'height': 450,
+                       'width': 500,
+                       'legend': {'title': {'text': ''}, 'tracegroupgap': 0, 'traceorder': 'reversed'},
+                       'xaxis': {'anchor': 'y', 'domain': [0.0, 1.0], 'title': {'text': 'Year'},
+                                 'tickvals': tickvals},
+                       'yaxis': {'anchor': 'x', 'domain': [0.0, 1.0], 'title': {'text': 'Average AQI'}}},
+        })
+    return figures
+
+
+def trend_subplots(dff, pollutants=None, first_year=FIRST_YEAR, columns=3):
+    """All pollutants as panels of a single figure sharing one legend."""
+    pollutants = pollutants or config.TREND_POLLUTANTS
+    groups = _group(dff, [name for _, name, _ in pollutants], first_year)
+    tickvals = _tickvals(first_year, groups)
+
+    rows = -(-len(pollutants) // columns)
+    gap_x, gap_y = 0.06, 0.12
+    width = (1 - gap_x * (columns - 1)) / columns
+    height = (1 - gap_y * (rows - 1)) / rows
+
+    data = []
+    layout = {'template': TEMPLATE,
+              'height': 380 * rows,
+              'legend': {'title': {'text': ''}, 'tracegroupgap': 0, 'traceorder': 'reversed'},
+              'annotations': []}
+    for i, (_, name, title) in enumerate(pollutants):
+        row, column = divmod(i, columns)
+        suffix = '' if i == 0 else str(i + 1)
+        x0 = column * (width + gap_x)
+        y1 = 1 - row * (height + gap_y)
+        data.extend(_traces(groups[name], 'x' + suffix, 'y' + suffix, showlegend=(i == 0)))
+        layout['xaxis' + suffix] = {'anchor': 'y' + suffix,
+                                    'domain': [round(x0, 6), min(1.0, round(x0 + width, 6))],
+                                    'title': {'text': 'Year'}, 'tickvals': tickvals}
+        layout['yaxis' + suffix] = {'anchor': 'x' + suffix,
+                                    'domain': [max(0.0, round(y1 - height, 6)), round(y1, 6)],
+                                    'title': {'text': 'Average AQI'}}
+        layout['annotations'].append({'text': title, 'showarrow': False,
+                                      'xref': 'paper', 'yref': 'paper',
+                                      'x': x0 + width / 2, 'y': y1,
+                                      'xanchor': 'center', 'yanchor': 'bottom'})
+    return {'data': data, 'layout': layout}
+
+
+##### Caching #####
+
+def trend_bundle(dff):
+    """The trend figures as plain JSON-able dicts, ready to be cached."""
+    return trend_figures(dff)
+
+
+# Builds in flight, so concurrent misses for one county wait on a single
+# build, and the pool running them (created per process, after any fork)
+_builds = {}
+_builds_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+
+
+def _build_pool():
+    global _pool, _pool_pid
+    with _builds_lock:
+        if _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(config.FIGURE_BUILD_THREADS, thread_name_prefix='figures')
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _build(cache, county_index, county_fips, key):
+    try:
+        with metrics.span('filter'):
+            dff = county_index.history_rows(county_fips)
+        with metrics.span('build'):
+            bundle = trend_bundle(dff)
+        with metrics.span('cache_put'):
+            cache.put(key, bundle)
+        return bundle
+    finally:
+        with _builds_lock:
+            _builds.pop(key, None)
+
+
+def get_trend_bundle(cache, county_index, county_fips):
+    """Cached trend figures for a county, building them on a miss.
+
+    Counties the index does not know get their (empty) figures built but
+    not cached, so requests cannot fill the cache with arbitrary keys.
+    """
+    if county_fips not in county_index:
+        return trend_bundle(county_index.history_rows(county_fips))
+    key = (county_fips, cache.version)
+    with metrics.span('cache_get'):
+        bundle = cache.get(key)
+    if bundle is not None:
+        return bundle
+    if config.FIGURE_BUILD_THREADS <= 0:
+        return _build(cache, county_index, county_fips, key)
+
+    pool = _build_pool()
+    with _builds_lock:
+        build = _builds.get(key)
+        if build is None:
+            build = _builds[key] = pool.submit(_build, cache, county_index, county_fips, key)
+    return build.result()
+
+
+def warm(data_version=None):
+    """Render every county's bundle into the shared on-disk cache tier."""
+    # Imported here: they pull in pandas, which the app itself only needs
+    # once its data is loaded (see app_state.py)
+    import datastore
+    from county_index import CountyIndex
+
+    data_version = data_version or datastore.current_version()
+    if data_version is None or not config.FIGURE_CACHE_DIR:
+        sys.exit("Warming needs an ingested data store and FIGURE_CACHE_DIR")
+
+    county_index = CountyIndex(datastore.load_table('choropleth', data_version),
+                               datastore.load_table('supplementary_viz', data_version),
+                               datastore.load_table('recommendations_2022', data_version))
+    # Memory tier of size 0: bundles only go to disk
+    version = cache_version(data_version)
+    cache = FigureCache(0, config.FIGURE_CACHE_DIR, version)
+    for i, county_fips in enumerate(county_index.fips_codes(), 1):
+        if not cache.on_disk((county_fips, version)):
+            cache.put((county_fips, version), trend_bundle(county_index.history_rows(county_fips)))
+        if i % 500 == 0:
+            print("%d counties" % i)
+    print("Warmed %d counties into %s" % (i, cache.disk_path(version)))
+
+
+if __name__ == '__main__':
+    # python figures.py warm
+    if sys.argv[1:] != ['warm']:
+        sys.exit("usage: python figures.py warm")
+    warm()
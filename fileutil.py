@@ -0,0 +1,25 @@
+import os
+import threading
+from contextlib import contextmanager
+
+# File helpers shared by the caches and the data store.
+
+
+@contextmanager
+def atomic_write(path, mode='wb'):
+    """Open a temporary file next to `path`, which replaces `path` once fully written.
+
+    Readers (other workers included) see the old file or the complete new
+    one, never a partial write. If the block fails, `path` is left as it
+    was. Missing parent directories are created; OSError is left to the
+    caller, e.g. to carry on without a cache on a read-only file system.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
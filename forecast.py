@@ -0,0 +1,152 @@
+import hashlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config
+import datastore
+import recommend
+
+# Batch forecasts for the per-pollutant trend series.
+#
+# Every (county, pollutant) series is laid out as one row of a dense
+# series x year matrix (NaN where a year is missing), and each model fits
+# all rows at once with array operations. Large batches are split across a
+# process pool. The output rows carry forecast == FORECAST and are appended
+# to the history, which is what the trend figures colour by. Run on its
+# own, it republishes the current store with new forecasts, and with the
+# map and recommendation tables rebuilt for the new last year.
+#
+#     python forecast.py [horizon] [method]
+
+HISTORICAL = 'Historical'
+FORECAST = 'Forecast'
+
+METHODS = ('linear', 'holt')
+
+# Below this many series the pool costs more than it saves
+PARALLEL_MIN_SERIES = 50000
+
+
+##### Models #####
+
+def linear_trend(years, values, horizon):
+    """Least-squares line through each row's observed years, extended `horizon` years."""
+    observed = ~np.isnan(values)
+    x = np.where(observed, years, 0.0)
+    y = np.where(observed, values, 0.0)
+    n = observed.sum(axis=1)
+    sx, sy = x.sum(axis=1), y.sum(axis=1)
+    sxx, sxy = (x * x).sum(axis=1), (x * y).sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = n * sxx - sx * sx
+        slope = np.where(denominator > 0, (n * sxy - sx * sy) / denominator, 0.0)
+        intercept = (sy - slope * sx) / n
+
+    future = years[-1] + np.arange(1, horizon + 1)
+    return intercept[:, None] + slope[:, None] * future[None, :]
+
+
+def holt(years, values, horizon, alpha=0.5, beta=0.3):
+    """Holt's linear exponential smoothing, run over all rows together.
+
+    Missing years advance the level by the trend without an observation.
+    """
+    level = np.full(len(values), np.nan)
+    trend = np.zeros(len(values))
+    for t in range(values.shape[1]):
+        y = values[:, t]
+        observed = ~np.isnan(y)
+        started = ~np.isnan(level)
+
+        predicted = level + trend
+        new_level = np.where(observed, alpha * y + (1 - alpha) * predicted, predicted)
+        new_trend = np.where(observed, beta * (new_level - level) + (1 - beta) * trend, trend)
+
+        # A series starts at its first observation
+        first = observed & ~started
+        level = np.where(first, y, np.where(started, new_level, level))
+        trend = np.where(started, new_trend, trend)
+
+    steps = np.arange(1, horizon + 1)
+    return level[:, None] + trend[:, None] * steps[None, :]
+
+
+def _fit(args):
+    method, years, values, horizon = args
+    predicted = (linear_trend if method == 'linear' else holt)(years, values, horizon)
+    # AQI is never negative
+    return np.clip(predicted, 0, None)
+
+
+def fit(years, values, horizon, method='linear', workers=None):
+    """Forecast `horizon` years for every row of `values` (series x years)."""
+    if method not in METHODS:
+        raise ValueError("Unknown forecast method %r, expected one of %s" % (method, METHODS))
+    years = np.asarray(years, dtype=float)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(values) < PARALLEL_MIN_SERIES:
+        return _fit((method, years, values, horizon))
+
+    chunks = np.array_split(values, workers)
+    with ProcessPoolExecutor(workers) as pool:
+        parts = pool.map(_fit, [(method, years, chunk, horizon) for chunk in chunks])
+        return np.concatenate(list(parts))
+
+
+##### History tables #####
+
+def forecast_history(history, horizon=None, method=None, window=None, workers=None):
+    """History with its forecast rows regenerated from the historical ones."""
+    horizon = config.FORECAST_HORIZON if horizon is None else horizon
+    method = method or config.FORECAST_METHOD
+    window = window or config.FORECAST_WINDOW
+
+    historical = history[history['forecast'].astype(str) == HISTORICAL]
+    keys = ['fips_code', 'county_name', 'state_name', 'parameter_name']
+    frame = pd.DataFrame({column: np.asarray(historical[column]) for column in keys + ['date', 'avg_aqi']})
+
+    # Series x year matrix over the fitting window
+    last_year = int(frame['date'].max())
+    frame = frame[frame['date'] > last_year - window]
+    matrix = frame.pivot_table(index=keys, columns='date', values='avg_aqi', aggfunc='mean')
+    values = matrix.to_numpy(dtype=float)
+    predicted = fit(matrix.columns.to_numpy(), values, horizon, method, workers)
+
+    future = pd.DataFrame(predicted, index=matrix.index,
+                          columns=pd.Index(range(last_year + 1, last_year + horizon + 1), name='date'))
+    future = future.stack().rename('avg_aqi').reset_index()
+    future['forecast'] = FORECAST
+
+    rows = pd.DataFrame({column: np.asarray(historical[column]) for column in historical.columns})
+    return pd.concat([rows, future[rows.columns]], ignore_index=True)
+
+
+def run(horizon=None, method=None, data_dir=None):
+    """Regenerate the forecasts of the current store and publish them as a new version."""
+    version = datastore.current_version(data_dir)
+    if version is None:
+        sys.exit("No data store yet, run datastore.py or ingest.py first")
+    horizon = config.FORECAST_HORIZON if horizon is None else horizon
+    method = method or config.FORECAST_METHOD
+
+    tables = {name: datastore.load_table(name, version, data_dir) for name in datastore.TABLES}
+    tables['supplementary_viz'] = forecast_history(tables['supplementary_viz'], horizon, method)
+
+    # The map and recommendations follow the last forecast year, so they are
+    # rebuilt as ingest.py builds them (imported here: ingest imports this module)
+    import ingest
+    counties = tables['choropleth'][['fips_code', 'county_name', 'state_fips', 'state_name']]
+    tables['choropleth'], tables['recommendations_2022'] = ingest.map_tables(
+        tables['supplementary_viz'], counties, recommend.Adjacency.load())
+
+    key = '%s-%s-%d-%d' % (version, method, horizon, config.FORECAST_WINDOW)
+    return datastore.publish(tables, hashlib.sha256(key.encode('utf-8')).hexdigest()[:12], data_dir)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else None, sys.argv[2] if len(sys.argv) > 2 else None)
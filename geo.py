@@ -0,0 +1,366 @@
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+import flask
+import numpy as np
+
+import config
+from fileutil import atomic_write
+
+try:
+    import brotli
+except ImportError:
+    # Optional: without it the geometry is served gzip-compressed only
+    brotli = None
+
+# Bundled, pre-simplified county geometry.
+#
+# The source GeoJSON is simplified once at build time (`python geo.py build
+# <source.json>`) into several zoom levels that are committed under data/geo/
+# together with a manifest holding their checksums. At runtime the app only
+# reads those files, so a cold start never touches the network.
+#
+# The browser fetches the geometry as a static asset from a versioned URL
+# (see serve_counties), straight from the precompressed bundle.
+
+MANIFEST = 'manifest.json'
+
+# Zoom level -> (Douglas-Peucker tolerance in degrees, decimals kept)
+LEVELS = {
+    'z0': (0.05, 2),     # whole country, thumbnails
+    'z1': (0.01, 3),     # default dashboard view
+    'z2': (0.002, 4),    # zoomed in to a state
+}
+
+# Feature properties carried over from the source; the rest is dropped
+PROPERTIES = ('STATE', 'COUNTY', 'NAME', 'LSAD')
+
+# States covered by the map (50 states and DC): FIPS -> (name, USPS code)
+STATES = {
+    1: ('Alabama', 'AL'), 2: ('Alaska', 'AK'), 4: ('Arizona', 'AZ'), 5: ('Arkansas', 'AR'),
+    6: ('California', 'CA'), 8: ('Colorado', 'CO'), 9: ('Connecticut', 'CT'), 10: ('Delaware', 'DE'),
+    11: ('District of Columbia', 'DC'), 12: ('Florida', 'FL'), 13: ('Georgia', 'GA'), 15: ('Hawaii', 'HI'),
+    16: ('Idaho', 'ID'), 17: ('Illinois', 'IL'), 18: ('Indiana', 'IN'), 19: ('Iowa', 'IA'),
+    20: ('Kansas', 'KS'), 21: ('Kentucky', 'KY'), 22: ('Louisiana', 'LA'), 23: ('Maine', 'ME'),
+    24: ('Maryland', 'MD'), 25: ('Massachusetts', 'MA'), 26: ('Michigan', 'MI'), 27: ('Minnesota', 'MN'),
+    28: ('Mississippi', 'MS'), 29: ('Missouri', 'MO'), 30: ('Montana', 'MT'), 31: ('Nebraska', 'NE'),
+    32: ('Nevada', 'NV'), 33: ('New Hampshire', 'NH'), 34: ('New Jersey', 'NJ'), 35: ('New Mexico', 'NM'),
+    36: ('New York', 'NY'), 37: ('North Carolina', 'NC'), 38: ('North Dakota', 'ND'), 39: ('Ohio', 'OH'),
+    40: ('Oklahoma', 'OK'), 41: ('Oregon', 'OR'), 42: ('Pennsylvania', 'PA'), 44: ('Rhode Island', 'RI'),
+    45: ('South Carolina', 'SC'), 46: ('South Dakota', 'SD'), 47: ('Tennessee', 'TN'), 48: ('Texas', 'TX'),
+    49: ('Utah', 'UT'), 50: ('Vermont', 'VT'), 51: ('Virginia', 'VA'), 53: ('Washington', 'WA'),
+    54: ('West Virginia', 'WV'), 55: ('Wisconsin', 'WI'), 56: ('Wyoming', 'WY'),
+}
+
+
+##### Loading #####
+
+def read_manifest(geo_dir=None):
+    with open(os.path.join(geo_dir or config.GEO_DIR, MANIFEST)) as f:
+        return json.load(f)
+
+
+def _sha256(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+
+def load_counties_bytes(level=None, geo_dir=None, cache_dir=None):
+    """Return the raw GeoJSON bytes for `level`, going through the local cache."""
+    level = level or config.GEO_LEVEL
+    geo_dir = geo_dir or config.GEO_DIR
+    cache_dir = cache_dir or config.CACHE_DIR
+
+    manifest = read_manifest(geo_dir)
+    if level not in manifest['levels']:
+        raise ValueError("Unknown geometry level %r, expected one of %s"
+                         % (level, sorted(manifest['levels'])))
+    entry = manifest['levels'][level]
+
+    # Cached copy is used only if its checksum matches the manifest
+    cache_path = os.path.join(cache_dir, 'counties-%s-%s.json' % (manifest['version'], level))
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            raw = f.read()
+        if _sha256(raw) == entry['sha256']:
+            return raw
+
+    with gzip.open(os.path.join(geo_dir, entry['file']), 'rb') as f:
+        raw = f.read()
+    if _sha256(raw) != entry['sha256']:
+        raise ValueError("Checksum mismatch for bundled geometry %s" % entry['file'])
+
+    try:
+        with atomic_write(cache_path) as f:
+            f.write(raw)
+    except OSError:
+        # Read-only filesystem: serve straight from the bundle
+        pass
+    return raw
+
+
+def load_counties(level=None, geo_dir=None, cache_dir=None):
+    """Load the county FeatureCollection, keyed by 5-digit FIPS in `id`."""
+    return json.loads(load_counties_bytes(level, geo_dir, cache_dir).decode('utf-8'))
+
+
+def county_adjacency(collection):
+    """{fips: set of neighbouring fips}, counties touching in at least one vertex.
+
+    Simplification keeps every vertex where borders meet, but rounding at the
+    coarser levels can snap nearby counties together, so use the finest one.
+    """
+    owners = {}
+    for feature in collection['features']:
+        for polygon in _rings(feature['geometry']):
+            for ring in polygon:
+                for point in ring:
+                    owners.setdefault(tuple(point), set()).add(feature['id'])
+
+    neighbours = {feature['id']: set() for feature in collection['features']}
+    for ids in owners.values():
+        if len(ids) > 1:
+            for fips in ids:
+                neighbours[fips].update(ids)
+    for fips, ids in neighbours.items():
+        ids.discard(fips)
+    return neighbours
+
+
+##### Serving #####
+
+def _brotli_path(level, manifest, cache_dir=None):
+    entry = manifest['levels'][level]
+    return os.path.join(cache_dir or config.CACHE_DIR, 'counties-%s-%s.json.br' % (manifest['version'], entry['sha256'][:12]))
+
+
+def compress(geo_dir=None, cache_dir=None):
+    """Precompress every level with brotli into the local cache, if brotli is installed."""
+    if brotli is None:
+        print("brotli is not installed, the geometry will be served gzip-compressed")
+        return
+    manifest = read_manifest(geo_dir)
+    for level in sorted(manifest['levels']):
+        path = _brotli_path(level, manifest, cache_dir)
+        if not os.path.exists(path):
+            with atomic_write(path) as f:
+                f.write(brotli.compress(load_counties_bytes(level, geo_dir, cache_dir)))
+        print("%s: %d bytes brotli" % (level, os.path.getsize(path)))
+
+
+def encoded_counties(level, encoding=None, geo_dir=None, cache_dir=None):
+    """GeoJSON bytes of `level` as stored: 'gzip' (the bundle), 'br' (precompressed) or None."""
+    manifest = read_manifest(geo_dir)
+    if encoding == 'gzip':
+        with open(os.path.join(geo_dir or config.GEO_DIR, manifest['levels'][level]['file']), 'rb') as f:
+            return f.read()
+    if encoding == 'br':
+        with open(_brotli_path(level, manifest, cache_dir), 'rb') as f:
+            return f.read()
+    return load_counties_bytes(level, geo_dir, cache_dir)
+
+
+def counties_url(level=None, prefix='/'):
+    """Versioned URL of the county geometry, for the `geojson` of a choropleth trace."""
+    return '%sgeo/%s/counties-%s.json' % (prefix, read_manifest()['version'], level or config.GEO_LEVEL)
+
+
+def serve_counties(server, prefix='/'):
+    """Serve the geometry at counties_url() with a strong ETag and a year-long cache lifetime.
+
+    Each level/encoding is read once per process; URLs change with the
+    geometry version, so the responses never go stale.
+    """
+    manifest = read_manifest()
+    encodings = ['gzip', None]
+    if brotli is not None and os.path.exists(_brotli_path(config.GEO_LEVEL, manifest)):
+        encodings.insert(0, 'br')
+    bodies = {}
+
+    @server.route(prefix + 'geo/<version>/counties-<level>.json')
+    def counties_asset(version, level):
+        if version != manifest['version'] or level not in manifest['levels']:
+            flask.abort(404)
+        accepted = flask.request.accept_encodings
+        encoding = next(e for e in encodings if e is None or e in accepted)
+        if (level, encoding) not in bodies:
+            try:
+                bodies[level, encoding] = encoded_counties(level, encoding)
+            except OSError:
+                # Only the default level is precompressed with brotli
+                encoding = 'gzip' if 'gzip' in accepted else None
+                bodies[level, encoding] = encoded_counties(level, encoding)
+
+        response = flask.Response(bodies[level, encoding], mimetype='application/json')
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % (365 * 24 * 3600)
+        # A strong ETag names one representation, so it differs per encoding
+        etag = manifest['levels'][level]['sha256']
+        response.set_etag(etag if encoding is None else '%s-%s' % (etag, encoding))
+        return response.make_conditional(flask.request)
+
+
+##### Simplification #####
+
+def _rings(geometry):
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    return geometry['coordinates']
+
+
+def _find_junctions(features):
+    # A vertex is a junction when it is not surrounded by the same pair of
+    # neighbours everywhere it occurs, i.e. where two shared borders meet.
+    # Splitting rings at junctions gives arcs that are identical in every
+    # county using them, so simplifying each arc once keeps borders shared.
+    neighbours = {}
+    junctions = set()
+    for feature in features:
+        for polygon in _rings(feature['geometry']):
+            for ring in polygon:
+                points = [tuple(p) for p in ring[:-1]]
+                n = len(points)
+                for i, p in enumerate(points):
+                    pair = frozenset((points[i - 1], points[(i + 1) % n]))
+                    seen = neighbours.setdefault(p, pair)
+                    if seen != pair:
+                        junctions.add(p)
+    return junctions
+
+
+def _douglas_peucker(points, tolerance):
+    # Always keep the farthest interior point so that no ring can collapse
+    # below four vertices, even when all of its arcs are nearly straight.
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1, True)]
+    while stack:
+        start, end, force = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[start + 1:end]
+        a, b = points[start], points[end]
+        d = b - a
+        norm = np.hypot(d[0], d[1])
+        if norm == 0:
+            dist = np.hypot(segment[:, 0] - a[0], segment[:, 1] - a[1])
+        else:
+            dist = np.abs(d[0] * (segment[:, 1] - a[1]) - d[1] * (segment[:, 0] - a[0])) / norm
+        i = int(np.argmax(dist))
+        if force or dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid, False))
+            stack.append((mid, end, False))
+    return points[keep]
+
+
+def _simplify_arc(arc, tolerance, decimals, memo):
+    # Arcs are memoised in a canonical direction so both counties sharing a
+    # border get exactly the same vertices back.
+    key = tuple(arc)
+    reverse = key[::-1] < key
+    if reverse:
+        key = key[::-1]
+    if key not in memo:
+        simplified = _douglas_peucker(np.array(key, dtype=float), tolerance)
+        memo[key] = [[round(x, decimals), round(y, decimals)] for x, y in simplified.tolist()]
+    return memo[key][::-1] if reverse else memo[key]
+
+
+def _simplify_ring(ring, junctions, tolerance, decimals, memo):
+    points = [tuple(p) for p in ring[:-1]]
+    cuts = [i for i, p in enumerate(points) if p in junctions]
+
+    if not cuts:
+        # Islands and enclaves: split at the first vertex and the vertex
+        # farthest from it, so the ring becomes two open arcs.
+        first = np.array(points[0])
+        far = int(np.argmax(np.hypot(*(np.array(points) - first).T)))
+        cuts = sorted({0, far})
+
+    # Rotate so the ring starts on a cut, then walk arc by arc
+    points = points[cuts[0]:] + points[:cuts[0]]
+    cuts = [c - cuts[0] for c in cuts] + [len(points)]
+    points.append(points[0])
+
+    out = []
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        arc = _simplify_arc(points[start:end + 1], tolerance, decimals, memo)
+        out.extend(arc if not out else arc[1:])
+    return out
+
+
+def simplify(collection, tolerance, decimals):
+    """Topology-preserving simplification of a county FeatureCollection."""
+    features = collection['features']
+    junctions = _find_junctions(features)
+    memo = {}
+
+    out = []
+    for feature in features:
+        geometry = feature['geometry']
+        polygons = [[_simplify_ring(ring, junctions, tolerance, decimals, memo) for ring in polygon]
+                    for polygon in _rings(geometry)]
+
+        # Rings smaller than the rounding grid collapse; redo those on their
+        # own at a finer grid. The border mismatch is below a pixel anyway.
+        for polygon, source in zip(polygons, _rings(geometry)):
+            for i, ring in enumerate(polygon):
+                if len(set(map(tuple, ring))) < 3:
+                    polygon[i] = _simplify_ring(source[i], (), tolerance / 10, decimals + 2, {})
+        if geometry['type'] == 'Polygon':
+            coordinates = polygons[0]
+        else:
+            coordinates = polygons
+        out.append({'type': 'Feature',
+                    'id': feature['id'],
+                    'properties': {k: v for k, v in feature.get('properties', {}).items()
+                                   if k in PROPERTIES},
+                    'geometry': {'type': geometry['type'], 'coordinates': coordinates}})
+    return {'type': 'FeatureCollection', 'features': out}
+
+
+def build(source_path, version, geo_dir=None):
+    """Simplify `source_path` into every level and write the bundle + manifest."""
+    geo_dir = geo_dir or config.GEO_DIR
+    os.makedirs(geo_dir, exist_ok=True)
+    with open(source_path) as f:
+        collection = json.load(f)
+
+    manifest = {'version': version,
+                'source': os.path.basename(source_path),
+                'levels': {}}
+    for level, (tolerance, decimals) in sorted(LEVELS.items()):
+        simplified = simplify(collection, tolerance, decimals)
+        raw = json.dumps(simplified, separators=(',', ':')).encode('utf-8')
+        filename = 'counties_%s.json.gz' % level
+        # mtime=0 keeps the compressed bundle byte-for-byte reproducible
+        with open(os.path.join(geo_dir, filename), 'wb') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as gz:
+                gz.write(raw)
+        manifest['levels'][level] = {'file': filename,
+                                     'tolerance': tolerance,
+                                     'decimals': decimals,
+                                     'bytes': len(raw),
+                                     'sha256': _sha256(raw)}
+        print("%s: %d bytes" % (level, len(raw)))
+
+    with open(os.path.join(geo_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+if __name__ == '__main__':
+    # python geo.py build <source.geojson> <version>
+    # python geo.py compress
+    if sys.argv[1:] == ['compress']:
+        compress()
+    elif len(sys.argv) == 4 and sys.argv[1] == 'build':
+        build(sys.argv[2], sys.argv[3])
+    else:
+        sys.exit("usage: python geo.py build <source.geojson> <version> | python geo.py compress")
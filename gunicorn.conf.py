@@ -0,0 +1,66 @@
+import gc
+import os
+
+# Production serving settings, used by the Procfile:
+#
+#     gunicorn app:server -c gunicorn.conf.py
+#
+# The app is loaded once in the master and forked into a few threaded
+# workers. The data is shared copy-on-write between them: the tables come
+# from the memory-mapped store, the derived arrays are built (or restored
+# from a snapshot) before the fork, and gc.freeze() keeps the collector from
+# touching (and so copying) those objects in every worker. Rendered figures
+# go to a shared tier in /dev/shm, so each worker only needs a small
+# in-process LRU; it holds at most one file per county, and figures of
+# earlier data versions are deleted at startup. Every value can be overridden through the environment;
+# `python benchmarks/load_test.py --config gunicorn.conf.py` runs the load
+# test with these settings.
+
+preload_app = True
+
+# Threads let one worker serve slow clients and cache hits while figure
+# builds, which are CPU-bound, run on the bounded pool of figures.py
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+
+# Recycle workers now and then so fragmentation never builds up
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+# Heartbeat files on tmpfs, so a busy disk never stalls the workers
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# Defaults for the app in this mode, read before the app is preloaded
+raw_env = ['%s=%s' % (name, value) for name, value in [
+    ('FIGURE_CACHE_DIR', '/dev/shm/choropleth-air-pollutants/figures'),
+    ('FIGURE_CACHE_SIZE', '128'),
+] if name not in os.environ and os.path.isdir('/dev/shm')]
+
+
+def when_ready(server):
+    # The app only loads its data on first use (see app_state.py): load it
+    # and build the layout here, once, so the workers inherit them
+    if server.cfg.preload_app:
+        import app
+        app.serve_layout()
+        figure_cache = app.get_state().figure_cache
+    else:
+        import config
+        import datastore
+        import figures
+        from figure_cache import FigureCache
+        figure_cache = FigureCache(0, config.FIGURE_CACHE_DIR, figures.cache_version(datastore.current_version()))
+
+    # Only the current data's figures are ever read again: drop the rest,
+    # which on tmpfs would otherwise hold memory until a reboot
+    figure_cache.prune()
+
+    # Move everything allocated so far out of the collector's reach before
+    # the workers are forked
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import re
+import sys
+
+import pandas as pd
+
+import config
+import datastore
+import forecast
+import geo
+import recommend
+
+# Rebuild the app's tables from raw EPA files.
+#
+# Input is a directory of EPA AQS daily summary files, one per pollutant and
+# year as published at https://aqs.epa.gov/aqsweb/airdata/download_files.html
+# (daily_42101_2019.csv or .zip for CO, 44201 ozone, 42602 NO2, 42401 SO2,
+# 88101 PM2.5). Each file is read in chunks and reduced to per-county, per-
+# pollutant, per-year AQI sums and counts. Those partial aggregates are kept
+# between runs next to the data store, so a new run only re-reads the files
+# whose size or modification time changed (e.g. the current year) before
+# the choropleth, history and recommendation tables are rebuilt from them
+# and published as a new store version. The history gets forecast rows
+# from forecast.py, so the map and recommendations reflect the last
+# forecast year.
+#
+#     python ingest.py [raw directory]
+
+RAW_FILE = re.compile(r'^daily_(\d{5})_(\d{4})\.(csv|zip)$')
+COLUMNS = ['State Code', 'County Code', 'Parameter Name', 'Date Local', 'AQI']
+CHUNK_ROWS = 200000
+
+# Census LSAD codes -> suffix of the full county name
+LSAD_SUFFIX = {'03': ' City and Borough', '04': ' Borough', '05': ' Census Area', '06': ' County',
+               '07': ' District', '12': ' Municipality', '13': ' Municipio', '15': ' Parish',
+               '25': ' city'}
+
+##### Partial aggregates #####
+
+def _signature(path):
+    stat = os.stat(path)
+    return '%d-%d' % (stat.st_size, stat.st_mtime_ns)
+
+
+def aggregate_file(path):
+    """Stream one raw file into AQI sum/count per (fips, parameter, year)."""
+    totals = None
+    for chunk in pd.read_csv(path, usecols=COLUMNS, chunksize=CHUNK_ROWS,
+                             dtype={'State Code': str, 'County Code': str, 'Date Local': str}):
+        # Drop rows without an AQI and non-US sites (State Code 'CC' is Canada)
+        chunk = chunk[chunk['AQI'].notna() & chunk['State Code'].str.isdigit()]
+        part = pd.DataFrame({
+            'fips_code': chunk['State Code'].astype(int) * 1000 + chunk['County Code'].astype(int),
+            'parameter_name': chunk['Parameter Name'],
+            'date': chunk['Date Local'].str[:4].astype(int),
+            'aqi_sum': chunk['AQI'].astype(float),
+            'aqi_count': 1,
+        }).groupby(['fips_code', 'parameter_name', 'date'], as_index=False).sum()
+        # Fold each chunk in straight away, so memory stays bounded by the
+        # number of counties rather than the number of rows
+        totals = part if totals is None else (
+            pd.concat([totals, part]).groupby(['fips_code', 'parameter_name', 'date'], as_index=False).sum())
+    if totals is None:
+        totals = pd.DataFrame(columns=['fips_code', 'parameter_name', 'date', 'aqi_sum', 'aqi_count'])
+    return totals
+
+
+def update_partials(raw_dir, partial_dir):
+    """Re-aggregate new or changed raw files.
+
+    Returns ({file name: partial path}, version), where the version changes
+    whenever any input file does.
+    """
+    os.makedirs(partial_dir, exist_ok=True)
+    manifest_path = os.path.join(partial_dir, 'manifest.json')
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+
+    raw_files = sorted(name for name in os.listdir(raw_dir) if RAW_FILE.match(name))
+    if not raw_files:
+        sys.exit("No EPA daily files (daily_<parameter>_<year>.csv|zip) in %s" % raw_dir)
+
+    for name in raw_files:
+        signature = _signature(os.path.join(raw_dir, name))
+        partial_path = os.path.join(partial_dir, os.path.splitext(name)[0] + '.csv')
+        if manifest.get(name) == signature and os.path.exists(partial_path):
+            continue
+        print("aggregating %s" % name)
+        aggregate_file(os.path.join(raw_dir, name)).to_csv(partial_path, index=False)
+        manifest[name] = signature
+        # Save progress after every file so an interrupted run resumes here
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+    # Files that disappeared from the raw directory no longer contribute
+    for name in set(manifest) - set(raw_files):
+        del manifest[name]
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    # County names and neighbours come from the geometry, so its version counts too
+    key = json.dumps([manifest, geo.read_manifest()['version']], sort_keys=True)
+    version = hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]
+    return {name: os.path.join(partial_dir, os.path.splitext(name)[0] + '.csv') for name in raw_files}, version
+
+
+##### Tables #####
+
+def counties_table(collection):
+    """One row per county on the map: fips_code, county_name, state_fips, state_name."""
+    rows = []
+    for feature in collection['features']:
+        properties = feature['properties']
+        state_fips = int(properties['STATE'])
+        if state_fips not in geo.STATES:
+            continue
+        rows.append((int(feature['id']), properties['NAME'] + LSAD_SUFFIX.get(properties.get('LSAD'), ''),
+                     state_fips, geo.STATES[state_fips][0]))
+    return pd.DataFrame(rows, columns=['fips_code', 'county_name', 'state_fips', 'state_name'])
+
+
+def history_table(partials, counties):
+    """Yearly average AQI per county and pollutant (the history behind update_graph)."""
+    totals = pd.concat([pd.read_csv(path) for path in partials.values()])
+    totals = totals.groupby(['fips_code', 'parameter_name', 'date'], as_index=False).sum()
+    totals['avg_aqi'] = totals['aqi_sum'] / totals['aqi_count']
+    totals['forecast'] = forecast.HISTORICAL
+    history = totals.merge(counties[['fips_code', 'county_name', 'state_name']], on='fips_code')
+    return history[['fips_code', 'county_name', 'state_name', 'parameter_name', 'date', 'avg_aqi', 'forecast']]
+
+
+def choropleth_table(history, counties):
+    """Average AQI per county in the latest year, with per-state reliability.
+
+    Counties without a monitor take the average of the monitored counties in
+    their state; `reliability` is the share of a state's counties that have one.
+    """
+    latest = history[history['date'] == history['date'].max()]
+    measured = latest.groupby('fips_code')['avg_aqi'].mean().rename('measured_aqi')
+
+    choro = counties.merge(measured, left_on='fips_code', right_index=True, how='left')
+    choro['counties'] = choro.groupby('state_fips')['fips_code'].transform('size')
+    choro['counties_monitors'] = choro.groupby('state_fips')['measured_aqi'].transform('count')
+    choro['reliability'] = choro['counties_monitors'] / choro['counties']
+    state_mean = choro.groupby('state_fips')['measured_aqi'].transform('mean')
+    choro['avg_aqi'] = choro['measured_aqi'].fillna(state_mean)
+    # States with no monitor at all get the national average
+    choro['avg_aqi'] = choro['avg_aqi'].fillna(choro['measured_aqi'].mean())
+    return choro[['fips_code', 'county_name', 'state_fips', 'state_name', 'avg_aqi',
+                  'counties', 'counties_monitors', 'reliability']]
+
+
+def map_tables(history, counties, adjacency):
+    """The choropleth and recommendation tables for the latest year of `history`."""
+    choro = choropleth_table(history, counties)
+    engine = recommend.RecommendationEngine(adjacency, choro.set_index('fips_code')['avg_aqi'].reindex(adjacency.fips))
+    return choro, recommend.recommendations_table(choro, engine)
+
+
+def run(raw_dir=None, data_dir=None):
+    raw_dir = raw_dir or config.RAW_DIR
+    partials, version = update_partials(raw_dir, os.path.join(datastore.store_dir(data_dir), 'partials'))
+    key = '%s-%s-%d-%d' % (version, config.FORECAST_METHOD, config.FORECAST_HORIZON, config.FORECAST_WINDOW)
+    version = hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]
+
+    if datastore.current_version(data_dir) == version:
+        print("Store is up to date (%s)" % version)
+        return version
+
+    # Adjacency comes from the finest geometry level, see geo.county_adjacency
+    collection = geo.load_counties('z2')
+    counties = counties_table(collection)
+    history = forecast.forecast_history(history_table(partials, counties))
+    choro, recommendations = map_tables(history, counties, recommend.Adjacency.from_geometry(collection))
+
+    return datastore.publish({'choropleth': choro,
+                              'supplementary_viz': history,
+                              'recommendations_2022': recommendations}, version, data_dir)
+
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,123 @@
+import numpy as np
+
+import choropleth
+import config
+from figures import FIRST_YEAR
+
+# Per-year, per-pollutant values for the choropleth, built once at startup.
+#
+# Every layer is a dense float32 array aligned to the county order of the
+# map (df_choro), held in one (year, pollutant, county) block together with
+# its reliability. Switching the map to another layer is a lookup plus the
+# value vector sent to the browser (see choropleth.py), never a new figure.
+# Layers follow the rules of the yearly map table built by ingest.py: a
+# county's "all pollutants" value is the mean of its pollutants, counties
+# without data take their state's mean (or the national one), and
+# reliability is the share of a state's counties that have data.
+
+ALL_POLLUTANTS = 'All pollutants'
+
+# The map as first shown: df_choro's own values, whatever the year
+OVERVIEW = 'Overview'
+
+
+def _positions(keys, values):
+    # Position of each of `values` in `keys`, -1 where missing
+    keys, values = np.asarray(keys), np.asarray(values)
+    if not len(keys):
+        return np.full(len(values), -1)
+    order = np.argsort(keys, kind='mergesort')
+    found = order[np.minimum(np.searchsorted(keys, values, sorter=order), len(keys) - 1)]
+    return np.where(keys[found] == values, found, -1)
+
+
+class MapLayers:
+
+    def __init__(self, df_choro, df_supp, pollutants=None, first_year=FIRST_YEAR):
+        pollutants = pollutants or config.TREND_POLLUTANTS
+        self.fips = df_choro['fips_code'].to_numpy()
+        self.pollutants = [ALL_POLLUTANTS] + [name for _, name, _ in pollutants]
+        self.titles = {name: title for _, name, title in pollutants}
+        self.overview = choropleth.values(df_choro['avg_aqi'], df_choro['reliability'])
+
+        # History rows -> (year, pollutant, county) positions
+        county = _positions(self.fips, df_supp['fips_code'].to_numpy())
+        pollutant = _positions(self.pollutants[1:], np.asarray(df_supp['parameter_name'].astype(str)))
+        date = df_supp['date'].to_numpy()
+        keep = (county >= 0) & (pollutant >= 0) & (date >= first_year)
+        self.years = np.unique(date[keep]).tolist()
+        year = np.searchsorted(self.years, date[keep])
+
+        shape = (len(self.years), len(self.pollutants), len(self.fips))
+        sums = np.zeros(shape)
+        counts = np.zeros(shape)
+        index = (year, pollutant[keep] + 1, county[keep])
+        np.add.at(sums, index, df_supp['avg_aqi'].to_numpy()[keep])
+        np.add.at(counts, index, 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            measured = sums / counts
+            # All pollutants: mean over the pollutants a county has
+            has = counts[:, 1:] > 0
+            measured[:, 0] = np.where(has, measured[:, 1:], 0).sum(axis=1) / has.sum(axis=1)
+
+        self.values, self.reliability = self._fill(measured.reshape(-1, len(self.fips)))
+        self.values = self.values.reshape(shape)
+        self.reliability = self.reliability.reshape(shape)
+        self._payloads = {}
+
+    def _fill(self, measured):
+        # State means for counties without data, and per-state reliability,
+        # for all layers (rows of `measured`) at once
+        state_codes, state = np.unique(self.fips // 1000, return_inverse=True)
+        layers = np.repeat(np.arange(len(measured)), len(self.fips))
+        states = np.tile(state, len(measured))
+        flat = measured.ravel()
+        has = ~np.isnan(flat)
+
+        size = (len(measured), len(state_codes))
+        state_sums = np.zeros(size)
+        state_counts = np.zeros(size)
+        np.add.at(state_sums, (layers[has], states[has]), flat[has])
+        np.add.at(state_counts, (layers[has], states[has]), 1)
+        counties = np.bincount(state, minlength=len(state_codes))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            state_mean = state_sums / state_counts
+            national = state_sums.sum(axis=1) / state_counts.sum(axis=1)
+        values = np.where(np.isnan(measured), state_mean[:, state], measured)
+        values = np.where(np.isnan(values), national[:, None], values)
+        reliability = (state_counts / counties)[:, state]
+        return values.astype(np.float32), reliability.astype(np.float32)
+
+    def key(self, pollutant, year=None):
+        """[pollutant, year] of the layer to show, with the year snapped to the
+        nearest one that has data; None for an unknown pollutant or year."""
+        if pollutant == OVERVIEW:
+            return [OVERVIEW, None]
+        if pollutant not in self.pollutants or not self.years:
+            return None
+        try:
+            year = int(year)
+        except (TypeError, ValueError):
+            return None
+        return [pollutant, min(self.years, key=lambda y: abs(y - year))]
+
+    def layer(self, pollutant, year):
+        """(values, reliability) arrays for one layer, in map county order."""
+        y = self.years.index(year)
+        p = self.pollutants.index(pollutant)
+        return self.values[y, p], self.reliability[y, p]
+
+    def payload(self, pollutant, year=None):
+        """The layer as choropleth values, ready for the 'choropleth-values' store."""
+        if pollutant == OVERVIEW:
+            return self.overview
+        key = (pollutant, year)
+        if key not in self._payloads:
+            self._payloads[key] = choropleth.values(*self.layer(pollutant, year))
+        return self._payloads[key]
+
+    def options(self):
+        """Dropdown options: the overview, then the pollutants as titled in the trend graphs."""
+        return [{'label': OVERVIEW, 'value': OVERVIEW}] + [
+            {'label': self.titles.get(name, name), 'value': name} for name in self.pollutants]
@@ -0,0 +1,231 @@
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+import flask
+
+import config
+
+# In-process timing spans and counters, served in the Prometheus text format.
+#
+# Spans time the stages of a request (data lookup, figure building, cache
+# access, the callback itself) into histograms; request hooks on the Flask
+# server count callback calls and response sizes; collectors registered by
+# the app (e.g. the figure cache) are read at scrape time. Every gunicorn
+# worker keeps its own numbers, so each scrape reports one worker, labelled
+# by `pid`.
+#
+# An optional sampling profiler records the stacks of all request threads
+# every PROFILER_INTERVAL_MS and serves them in the collapsed format used by
+# flamegraph.pl and speedscope.
+
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+DESCRIPTIONS = {
+    'app_span_seconds': ('histogram', "Time spent in each stage of a request"),
+    'app_callback_seconds': ('histogram', "Time spent inside each server callback"),
+    'app_request_seconds': ('histogram', "Dash request time, from request to response"),
+    'app_serialize_seconds': ('histogram', "Dash request time outside the callback (JSON encoding and dispatch)"),
+    'app_response_bytes': ('histogram', "Size of the responses of each callback and of the layout"),
+    'app_requests_total': ('counter', "Dash requests by callback and status"),
+}
+
+
+def escape(value):
+    """A label value escaped for the text format (backslash, double quote and newline)."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+##### Registry #####
+
+class Metrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = defaultdict(float)
+        self._collectors = []
+        self._local = threading.local()
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [buckets, [0] * len(buckets), 0, 0.0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[1][i] += 1
+                    break
+            histogram[2] += 1
+            histogram[3] += value
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('app_span_seconds', time.perf_counter() - start, span=name)
+
+    def timed(self, fn):
+        """Decorator for callbacks: records their time, which the request hooks subtract."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._local.callback_seconds = getattr(self._local, 'callback_seconds', 0.0) + elapsed
+                self.observe('app_callback_seconds', elapsed, callback=fn.__name__)
+        return wrapper
+
+    def add_collector(self, collect):
+        """`collect()` returns (name, type, help, labels, value) tuples, read at every scrape."""
+        self._collectors.append(collect)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        samples = defaultdict(list)
+        types = dict(DESCRIPTIONS)
+        with self._lock:
+            for (name, labels), (buckets, counts, count, total) in self._histograms.items():
+                cumulative = 0
+                for bound, n in zip(buckets, counts):
+                    cumulative += n
+                    samples[name].append((name + '_bucket', labels + (('le', repr(float(bound))),), cumulative))
+                samples[name].append((name + '_bucket', labels + (('le', '+Inf'),), count))
+                samples[name].append((name + '_sum', labels, total))
+                samples[name].append((name + '_count', labels, count))
+            for (name, labels), value in self._counters.items():
+                samples[name].append((name, labels, value))
+        for collect in self._collectors:
+            for name, kind, description, labels, value in collect():
+                types.setdefault(name, (kind, description))
+                samples[name].append((name, tuple(sorted(labels.items())), value))
+
+        pid = ('pid', str(os.getpid()))
+        lines = []
+        for name in sorted(samples):
+            kind, description = types.get(name, ('untyped', ''))
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for sample, labels, value in samples[name]:
+                text = ','.join('%s="%s"' % (k, escape(v)) for k, v in (pid,) + labels)
+                lines.append('%s{%s} %s' % (sample, text, repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+    ##### Flask hooks #####
+
+    def instrument(self, app, path='/metrics'):
+        """Time and count the Dash requests of `app` and serve the metrics at `path`."""
+        names = {}
+
+        def callback_name(output):
+            # Outputs come from the request: anything that is not a registered
+            # callback shares one label, so clients cannot add label values
+            if not isinstance(output, str) or output not in app.callback_map:
+                return 'unknown'
+            if output not in names:
+                callback = app.callback_map[output].get('callback')
+                names[output] = getattr(callback, '__name__', 'unknown')
+            return names[output]
+
+        @app.server.before_request
+        def start_request():
+            flask.g.metrics_start = time.perf_counter()
+            self._local.callback_seconds = 0.0
+            if profiler is not None:
+                profiler.start()
+
+        @app.server.after_request
+        def finish_request(response):
+            endpoint = flask.request.path.rsplit('/', 1)[-1]
+            if endpoint == '_dash-update-component':
+                body = flask.request.get_json(silent=True) or {}
+                name = callback_name(body.get('output', ''))
+            elif endpoint == '_dash-layout':
+                name = '_layout'
+            else:
+                return response
+
+            elapsed = time.perf_counter() - flask.g.get('metrics_start', time.perf_counter())
+            size = response.calculate_content_length() or 0
+            self.observe('app_request_seconds', elapsed, callback=name)
+            self.observe('app_serialize_seconds', max(0.0, elapsed - self._local.callback_seconds), callback=name)
+            self.observe('app_response_bytes', size, buckets=SIZE_BUCKETS, callback=name)
+            self.inc('app_requests_total', callback=name, status=str(response.status_code))
+            return response
+
+        @app.server.route(path)
+        def metrics_endpoint():
+            return flask.Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+        if profiler is not None:
+            @app.server.route(path + '/profile')
+            def profile_endpoint():
+                return flask.Response(profiler.collapsed(), mimetype='text/plain')
+
+
+##### Sampling profiler #####
+
+class SamplingProfiler:
+    """Counts the stacks of every other thread, sampled from a daemon thread."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = Counter()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        # Threads do not survive a fork, so each (preloaded) worker starts
+        # its own sampler on its first request
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.samples.clear()
+        threading.Thread(target=self._run, name='sampling-profiler', daemon=True).start()
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(stack)))
+            with self._lock:
+                self.samples.update(stacks)
+
+    def collapsed(self):
+        """`frame;frame;frame count` lines, most frequent first."""
+        with self._lock:
+            return ''.join('%s %d\n' % (stack, n) for stack, n in self.samples.most_common())
+
+
+# The process-wide registry and, if enabled, the profiler
+metrics = Metrics()
+profiler = SamplingProfiler(config.PROFILER_INTERVAL_MS / 1000.0) if config.PROFILER_INTERVAL_MS > 0 else None
+
+span = metrics.span
+timed = metrics.timed
+add_collector = metrics.add_collector
+instrument = metrics.instrument
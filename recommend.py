@@ -0,0 +1,181 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import config
+import geo
+from fileutil import atomic_write
+
+# Neighbour-based recommendations.
+#
+# County adjacency is held as CSR arrays over a fixed, sorted order of FIPS
+# codes: the neighbours of county i are indices[indptr[i]:indptr[i + 1]].
+# A recommendation is the county with the lowest score within a
+# neighbourhood (the county itself plus its k-ring), computed for every
+# county at once with array operations. Scores can be any per-county value:
+# the choropleth AQI, or a weighted mix of pollutants for a given year.
+
+
+##### Adjacency index #####
+
+class Adjacency:
+
+    def __init__(self, fips, indptr, indices):
+        self.fips = np.asarray(fips, dtype=np.int32)
+        self.indptr = np.asarray(indptr, dtype=np.int32)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.position = {code: i for i, code in enumerate(self.fips.tolist())}
+
+    def __len__(self):
+        return len(self.fips)
+
+    @classmethod
+    def from_geometry(cls, collection):
+        neighbours = geo.county_adjacency(collection)
+        fips = sorted(int(code) for code in neighbours)
+        position = {code: i for i, code in enumerate(fips)}
+        indptr = [0]
+        indices = []
+        for code in fips:
+            indices.extend(sorted(position[int(n)] for n in neighbours['%05d' % code]))
+            indptr.append(len(indices))
+        return cls(fips, indptr, indices)
+
+    @classmethod
+    def load(cls, cache_dir=None):
+        """Adjacency of the bundled geometry, cached per geometry version."""
+        cache_dir = cache_dir or config.CACHE_DIR
+        path = os.path.join(cache_dir, 'adjacency-%s.npz' % geo.read_manifest()['version'])
+        if os.path.exists(path):
+            arrays = np.load(path)
+            return cls(arrays['fips'], arrays['indptr'], arrays['indices'])
+
+        # Adjacency needs the finest level, see geo.county_adjacency
+        adjacency = cls.from_geometry(geo.load_counties('z2'))
+        try:
+            with atomic_write(path) as f:
+                np.savez(f, fips=adjacency.fips, indptr=adjacency.indptr, indices=adjacency.indices)
+        except OSError:
+            pass
+        return adjacency
+
+    def ring(self, k):
+        """CSR (indptr, indices) of each county's neighbourhood up to k steps, itself included."""
+        n = len(self.fips)
+        rows = np.arange(n, dtype=np.int64)
+        cols = np.arange(n, dtype=np.int64)
+        for _ in range(k):
+            # Extend every (row, col) pair by the neighbours of col
+            counts = np.diff(self.indptr)[cols]
+            starts = self.indptr[cols]
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            new_rows = np.repeat(rows, counts)
+            new_cols = self.indices[np.repeat(starts, counts) + offsets]
+            keys = np.unique(np.concatenate([rows * n + cols, new_rows * n + new_cols]))
+            rows, cols = keys // n, keys % n
+        indptr = np.searchsorted(rows, np.arange(n + 1)).astype(np.int32)
+        return indptr, cols.astype(np.int32)
+
+
+##### Scores #####
+
+def pollutant_scores(history, fips, year, weights=None):
+    """Weighted average AQI per county for `year`, aligned to `fips` (NaN if missing).
+
+    `weights` maps parameter_name to a weight; by default every pollutant
+    counts equally. Counties only weigh the pollutants they have data for.
+    """
+    rows = history[history['date'] == year]
+    parameter = rows['parameter_name'].astype(str)
+    if weights is None:
+        weight = np.ones(len(rows))
+    else:
+        weight = parameter.map(weights).fillna(0).to_numpy(dtype=float)
+    frame = pd.DataFrame({'fips_code': rows['fips_code'].to_numpy(),
+                          'weighted': rows['avg_aqi'].to_numpy() * weight,
+                          'weight': weight})
+    frame = frame[frame['weight'] > 0].groupby('fips_code').sum()
+    scores = (frame['weighted'] / frame['weight']).reindex(np.asarray(fips))
+    return scores.to_numpy(dtype=float)
+
+
+##### Engine #####
+
+class RecommendationEngine:
+    """Best county within each county's k-ring, kept up to date incrementally."""
+
+    def __init__(self, adjacency, scores, k=1):
+        self.adjacency = adjacency
+        self.k = k
+        self.indptr, self.indices = adjacency.ring(k)
+        self.scores = np.asarray(scores, dtype=float).copy()
+        self.best = np.arange(len(adjacency), dtype=np.int32)
+        self._recompute(np.arange(len(adjacency)))
+
+    def _recompute(self, rows):
+        # Candidates of the selected rows, flattened; missing scores never win
+        counts = self.indptr[rows + 1] - self.indptr[rows]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidates = self.indices[np.repeat(self.indptr[rows], counts) + offsets]
+        owner = np.repeat(np.arange(len(rows)), counts)
+        values = np.where(np.isnan(self.scores[candidates]), np.inf, self.scores[candidates])
+
+        # Sort by (owner, value, is-not-self) and keep the first of each
+        # owner; ties go to the county itself, then to the lowest FIPS code
+        not_self = candidates != np.repeat(rows, counts)
+        order = np.lexsort((candidates, not_self, values, owner))
+        first = order[np.r_[0, np.cumsum(counts)[:-1]]]
+        best = candidates[first]
+        # Counties whose whole neighbourhood lacks a score keep themselves
+        self.best[rows] = np.where(np.isinf(values[first]), rows, best)
+
+    def update(self, fips, scores):
+        """Change some counties' scores and recompute only the affected neighbourhoods.
+
+        Returns the FIPS codes whose recommendation was recomputed.
+        """
+        changed = np.array([self.adjacency.position[code] for code in fips], dtype=np.int64)
+        self.scores[changed] = scores
+        # Rings are symmetric, so the rows to redo are the rings of the changed counties
+        affected = np.unique(np.concatenate(
+            [self.indices[self.indptr[i]:self.indptr[i + 1]] for i in changed] or [np.array([], np.int32)]))
+        if len(affected):
+            self._recompute(affected.astype(np.int64))
+        return self.adjacency.fips[affected]
+
+    def recommendation(self, fips):
+        """(recommended FIPS, its score) for one county."""
+        best = self.best[self.adjacency.position[fips]]
+        return int(self.adjacency.fips[best]), float(self.scores[best])
+
+    def table(self):
+        """source_fips, adj_fips and rec_avg_aqi for every county."""
+        return pd.DataFrame({'source_fips': self.adjacency.fips,
+                             'adj_fips': self.adjacency.fips[self.best],
+                             'rec_avg_aqi': self.scores[self.best]})
+
+
+def recommendations_table(choro, engine):
+    """Recommendations for the counties in `choro`, laid out like recommendations_2022.csv."""
+    state_codes = {state: code for state, (_, code) in geo.STATES.items()}
+    names = dict(zip(choro['fips_code'].tolist(), choro['county_name'].astype(str)))
+    table = engine.table()
+    table = table[table['source_fips'].isin(list(names))].reset_index(drop=True)
+    source_state = table['source_fips'] // 1000
+    table['Source County'] = (table['source_fips'].map(names) + ', ' + source_state.map(state_codes))
+    table['source_state'] = source_state
+    table['rec_county_name'] = table['adj_fips'].map(names)
+    return table[['Source County', 'source_fips', 'adj_fips', 'source_state', 'rec_county_name', 'rec_avg_aqi']]
+
+
+def history_recommendations(choro, history, year, weights=None, k=1):
+    """Recommendations from the history table's `year`, weighting pollutants by `weights`.
+
+    Counties without data for that year fall back to their choropleth AQI.
+    """
+    adjacency = Adjacency.load()
+    scores = pollutant_scores(history, adjacency.fips, year, weights)
+    fallback = choro.set_index('fips_code')['avg_aqi'].reindex(adjacency.fips).to_numpy(dtype=float)
+    scores = np.where(np.isnan(scores), fallback, scores)
+    return recommendations_table(choro, RecommendationEngine(adjacency, scores, k))
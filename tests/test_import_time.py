@@ -0,0 +1,20 @@
+import importlib.util
+import os
+
+# Import-time checks of benchmarks/check_import_time.py, run under pytest.
+# The bound is a few times the benchmark's budget so a slow CI machine does
+# not fail it; the benchmark itself holds the app to the real budget.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+spec = importlib.util.spec_from_file_location('check_import_time',
+                                              os.path.join(ROOT, 'benchmarks', 'check_import_time.py'))
+check_import_time = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(check_import_time)
+
+
+def test_import_is_cheap():
+    result = check_import_time.measure(runs=1)
+    assert result['import_s'] < 3 * check_import_time.DEFAULT_BUDGET_S
+    assert result['loaded'] == []
+    assert not result['state_built']